@@ -7,6 +7,8 @@ import logging
 from routers import (post, account, category, chat, photo, locker)
 
 from core.db import Base, engine
+from core.middleware import BodySizeLimitMiddleware
+from core.storage import MAX_REQUEST_SIZE
 
 from mangum import Mangum
 import sentry_sdk
@@ -38,6 +40,7 @@ fastapi_app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+fastapi_app.add_middleware(BodySizeLimitMiddleware, max_size=MAX_REQUEST_SIZE)
 Base.metadata.create_all(bind=engine)
 
 
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import threading
+from os import environ
+from typing import Dict, Iterable, Set
+
+"""
+채팅 메시지를 WebSocket 연결들에게 전달하는 pub/sub broker
+channel 이름은 "room:{room_id}" 형식, publish 는 sync 코드(CRUD, session event)에서도 호출할 수 있음
+"""
+
+QUEUE_SIZE = 1000
+
+
+class Subscription:
+    """
+    WebSocket 연결 하나가 구독 중인 channel 들과 받은 메시지 queue
+    async for 로 메시지를 기다리고, 연결이 끝나면 close 로 구독을 해제
+    """
+    def __init__(self, broker: "InMemoryBroker", loop: asyncio.AbstractEventLoop) -> None:
+        self.broker = broker
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.channels: Set[str] = set()
+
+    def add(self, channel: str):
+        self.broker.add(self, channel)
+
+    def close(self):
+        self.broker.remove(self)
+
+    def deliver(self, payload: dict):
+        # publish 는 다른 thread 에서 올 수 있으므로 queue 는 항상 구독한 event loop 에서 채움
+        try:
+            self.loop.call_soon_threadsafe(self._put, payload)
+        except RuntimeError:  # event loop 가 이미 닫힘
+            self.close()
+
+    def _put(self, payload: dict):
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # 느린 연결은 메시지를 버리고, 클라이언트는 after_message_id 로 다시 가져옴
+            pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        return await self.queue.get()
+
+
+class InMemoryBroker:
+    """
+    한 process 안에서만 전달하는 broker, 서버가 process 하나일 때 사용
+    """
+    def __init__(self) -> None:
+        self.channels: Dict[str, Set[Subscription]] = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, channels: Iterable[str]) -> Subscription:
+        """
+        현재 event loop 에서 channels 를 구독
+        """
+        subscription = Subscription(self, asyncio.get_running_loop())
+        for channel in channels:
+            self.add(subscription, channel)
+        return subscription
+
+    def add(self, subscription: Subscription, channel: str):
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(subscription)
+            subscription.channels.add(channel)
+
+    def remove(self, subscription: Subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscribers = self.channels.get(channel)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.channels[channel]
+            subscription.channels.clear()
+
+    def publish(self, channel: str, payload: dict):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(payload)
+
+
+class LoopbackBroker(InMemoryBroker):
+    """
+    여러 process 용 broker(Redis pub/sub 등)를 붙이기 전의 로컬 대체품
+    메시지를 JSON 으로 직렬화해서 다시 읽은 뒤 전달하므로, 외부 broker 를 거칠 때와 같은 형태의 payload 만 전달됨
+    외부 broker 구현은 publish 에서 직렬화한 메시지를 보내고, 받은 메시지를 InMemoryBroker.publish 로 넘기면 됨
+    """
+    def publish(self, channel: str, payload: dict):
+        message = json.dumps({"channel": channel, "payload": payload}, default=str)
+        self.receive(message)
+
+    def receive(self, message: str):
+        message = json.loads(message)
+        super().publish(message["channel"], message["payload"])
+
+
+BROKERS = {"memory": InMemoryBroker, "loopback": LoopbackBroker}
+
+broker = BROKERS[environ.get("CHAT_BROKER", "memory")]()
+
+
+def room_channel(room_id: str) -> str:
+    return f"room:{room_id}"
@@ -1,17 +1,102 @@
+import base64
+import json
 import math
+from datetime import datetime
 
 from pydantic import BaseModel
-from sqlalchemy import func, case
-from sqlalchemy.orm import Session
+from sqlalchemy import case, tuple_, inspect, or_, and_, insert, update, delete, select, func, text, event
+from sqlalchemy.dialects.mysql import match, insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, Query
 
-from typing import Union, List
+from core.filters import parse_filters, bind_params, build_select, legacy_conditions
+from core.schema import MAX_SEARCH_LIMIT
+
+from typing import Union, List, Optional, Dict, Set
+
+
+@event.listens_for(Session, "after_commit")
+def run_on_commit(session):
+    for callback in session.info.pop("on_commit", []):
+        callback()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def discard_on_commit(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("on_commit", None)
+
+
+# create_many 에서 쓰는 DB 별 auto increment 증가폭 (연속 할당이 보장되지 않으면 None)
+_AUTOINC_STEP = {}
+# text_search_record 의 관련도 점수를 정렬, cursor 비교에 쓰기 전에 반올림하는 소수점 자리수
+SCORE_PRECISION = 6
+
+
+def encode_cursor(*values) -> str:
+    """
+    페이지의 마지막 항목 키 값들을 클라이언트에게 넘겨줄 불투명한 cursor 문자열로 변환
+    """
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, *types) -> list:
+    """
+    encode_cursor 로 만든 cursor 를 키 값 리스트로 복원, 각 자리의 값은 types 의 함수로 변환
+    형식이 맞지 않으면 ValueError
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("Invalid cursor")
+        return [to_type(value) for to_type, value in zip(types, values)]
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def ngrams(keyword: str, n: int = 2) -> List[str]:
+    """
+    MySQL ngram parser 와 같은 방식으로 검색어를 띄어쓰기 단위로 나누고 n글자씩 자름, n 보다 짧은 단어는 그대로 사용
+    """
+    grams = []
+    for word in keyword.split():
+        if len(word) <= n:
+            grams.append(word)
+        else:
+            grams.extend(word[i:i + n] for i in range(len(word) - n + 1))
+    return list(dict.fromkeys(grams))
 
 
 class CRUD:
-    def __init__(self, session: Session) -> None:
+    def __init__(self, session: Session, unit_of_work: bool = False) -> None:
         self.session = session
+        # unit_of_work 이면 각 method 는 flush 만 하고, commit/rollback 은 요청 단위로 get_uow_crud 에서 한 번만 함
+        self.unit_of_work = unit_of_work
         # self.query = self.session.query(table)
 
+    def _commit(self):
+        if self.unit_of_work:
+            self.session.flush()
+        else:
+            self.session.commit()
+
+    def commit(self):
+        """
+        지금까지의 변경을 commit, unit_of_work 모드에서 응답을 보내기 전에 저장을 확정할 때 사용
+        """
+        self.session.commit()
+
+    def on_commit(self, callback):
+        """
+        현재 transaction 이 commit 된 뒤에 callback 을 실행, rollback 되면 실행하지 않음
+        저장이 확정된 뒤에만 해야 하는 일(WebSocket 알림 등)에 사용
+        """
+        self.session.info.setdefault("on_commit", []).append(callback)
+
     def get_list(self, table: BaseModel):
         return self.session.query(table).all()
 
@@ -24,16 +109,59 @@ class CRUD:
     def create_record(self, table: BaseModel, req: BaseModel):
         db_record = table(**req.dict())
         self.session.add(db_record)
-        self.session.commit()
+        self._commit()
         self.session.refresh(db_record)
         return db_record
 
+    def create_many(self, table: BaseModel, reqs: List[Union[BaseModel, dict]], commit: bool = True) -> List[int]:
+        """
+        여러 record 를 생성하고 생성된 primary key 를 요청 순서대로 반환
+        RETURNING 을 지원하거나 auto increment 가 연속 할당되는 DB 는 한 번의 INSERT 문, 아니면(MySQL 8 기본값 등) row 별 INSERT
+        commit=False 면 commit 하지 않아서 이어지는 수정과 같은 transaction 으로 묶을 수 있음
+        """
+        rows = [req.dict() if isinstance(req, BaseModel) else req for req in reqs]
+        if not rows:
+            return []
+        pk = inspect(table).primary_key[0]
+        step = self._autoinc_step()
+        if self.session.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+            stmt = insert(table.__table__).returning(pk, sort_by_parameter_order=True)
+            ids = list(self.session.scalars(stmt, rows))
+        elif step is not None:
+            # MySQL 은 RETURNING 이 없어서 multi-row INSERT 의 첫 id(LAST_INSERT_ID)부터 연속으로 계산
+            result = self.session.execute(insert(table.__table__).values(rows))
+            ids = [result.lastrowid + idx * step for idx in range(len(rows))]
+        else:
+            # 연속된 id 가 보장되지 않는 설정이면 한 transaction 안에서 row 별로 insert
+            db_records = [table(**row) for row in rows]
+            self.session.add_all(db_records)
+            self.session.flush()
+            ids = [getattr(db_record, pk.key) for db_record in db_records]
+        if commit:
+            self._commit()
+        return ids
+
+    def _autoinc_step(self) -> Optional[int]:
+        """
+        multi-row INSERT 의 auto increment 값이 연속으로 할당되는 MySQL 설정이면 증가폭을, 아니면 None 을 반환
+        innodb_autoinc_lock_mode 2(interleaved)는 동시에 실행되는 INSERT 끼리 값이 섞일 수 있음
+        """
+        bind = self.session.get_bind()
+        if bind.dialect.name not in ("mysql", "mariadb"):
+            return None
+        if bind.url not in _AUTOINC_STEP:
+            lock_mode, increment = self.session.execute(
+                text("SELECT @@innodb_autoinc_lock_mode, @@auto_increment_increment")
+            ).one()
+            _AUTOINC_STEP[bind.url] = increment if lock_mode < 2 else None
+        return _AUTOINC_STEP[bind.url]
+
     def update_record(self, db_record: BaseModel, req: Union[BaseModel, dict]):
         if isinstance(req, BaseModel):
             req = req.dict()
         for key, value in req.items():
             setattr(db_record, key, value)
-        self.session.commit()
+        self._commit()
 
         return db_record
 
@@ -47,7 +175,7 @@ class CRUD:
                 setattr(db_record, key, value)
             if value is None:
                 setattr(db_record, key, value)
-        self.session.commit()
+        self._commit()
 
         return db_record
 
@@ -60,7 +188,7 @@ class CRUD:
                     setattr(db_record, key, value)
                 if value == 0:
                     setattr(db_record, key, value)
-        self.session.commit()
+        self._commit()
 
         return db_records
 
@@ -68,11 +196,55 @@ class CRUD:
         db_record = self.get_record(table, cond)
         if db_record:
             self.session.delete(db_record)
-            self.session.commit()
+            self._commit()
             return 1
         else:
             return -1
 
+    def insert_unique(self, table: BaseModel, req: BaseModel, savepoint: bool = False):
+        """
+        unique 제약이 있는 table 에 record 를 생성, 이미 같은 값이 있으면 transaction 을 rollback 하고 None 을 반환
+        중복 여부를 미리 SELECT 하지 않고 DB 의 제약 위반으로 판단함
+        savepoint 이면 SAVEPOINT 까지만 rollback 해서 같은 transaction 의 앞선 작업은 유지
+        """
+        db_record = table(**req.dict())
+        try:
+            if savepoint:
+                with self.session.begin_nested():
+                    self.session.add(db_record)
+            else:
+                self.session.add(db_record)
+                self.session.flush()
+        except IntegrityError:
+            if not savepoint:
+                self.session.rollback()
+            return None
+        self._commit()
+        self.session.refresh(db_record)
+        return db_record
+
+    def update_where(self, table: BaseModel, cond: dict, values: dict, *criteria) -> int:
+        """
+        cond 에 맞는 row 들을 UPDATE 한 문장으로 수정하고 수정된 row 수를 반환
+        values 에 {"liked": Post.liked + 1} 처럼 column 식을 넣으면 읽지 않고 DB 에서 바로 계산함
+        criteria 로 Message.message_id <= 10 같은 조건식을 더 줄 수 있고, session 에 이미 읽어온 record 에도 바뀐 값이 반영됨
+        """
+        filters = [getattr(table, key) == value for key, value in cond.items()]
+        stmt = update(table).where(*filters, *criteria).values(values)
+        result = self.session.execute(stmt)
+        self._commit()
+        return result.rowcount
+
+    def delete_where(self, table: BaseModel, cond: dict) -> int:
+        """
+        cond 에 맞는 row 들을 DELETE 한 문장으로 삭제하고 삭제된 row 수를 반환
+        """
+        filters = [getattr(table, key) == value for key, value in cond.items()]
+        stmt = delete(table).where(*filters).execution_options(synchronize_session=False)
+        result = self.session.execute(stmt)
+        self._commit()
+        return result.rowcount
+
     def paging_record(self, table: BaseModel, req: BaseModel):
         total_row = self.session.query(table).count()
         if total_row % req.size == 0:
@@ -85,29 +257,96 @@ class CRUD:
         pages = {"items": items, "total_pages": total_page, "page": req.page, "size": req.size, "total_row": total_row}
         return pages
 
-    def app_paging_record(self, table: BaseModel, size: int, checkpoint: int = 0):
+    def cursor_paging_record(self, table: BaseModel, req: BaseModel):
+        """
+        paging_record 의 cursor 버전, (create_time, primary key) 역순으로 cursor 다음 항목부터 읽음
+        전체 개수는 req.with_total 일 때만 셈
+        """
+        pk = inspect(table).primary_key[0]
+        query = self.session.query(table)
+        if req.cursor:
+            last_key = decode_cursor(req.cursor, datetime.fromisoformat, pk.type.python_type)
+            query = query.filter(tuple_(table.create_time, pk) < tuple(last_key))
+        items = query.order_by(table.create_time.desc(), pk.desc()).limit(req.size + 1).all()
+
+        next_cursor = None
+        if len(items) > req.size:
+            items = items[:req.size]
+            next_cursor = encode_cursor(items[-1].create_time, getattr(items[-1], pk.key))
+        pages = {"items": items, "next_cursor": next_cursor, "size": req.size}
+        if req.with_total:
+            pages["total_row"] = self.session.query(table).count()
+        return pages
+
+    def partition_count(self, counter: BaseModel, partition: str, query: Query):
+        """
+        counter 테이블에 유지되는 partition 의 row 수를 읽음
+        counter 는 쓰기 쪽에서 증감하고 scripts/reconcile_post_counters 로 채우거나 맞춤
+        row 가 없거나 아직 한 번도 맞추지 않은 row(reconcile_time 이 NULL)면 query 로 셈
+        """
+        db_record = self.session.get(counter, partition)
+        if db_record is not None and db_record.reconcile_time is not None:
+            return db_record.row_count
+        return query.count()
+
+    def app_paging_record(self, table: BaseModel, size: int, checkpoint: int = 0, counter: BaseModel = None):
         status_order = case(
             (table.status == 2, 1),
             else_=0
         )
 
         query = self.session.query(table).filter(table.use_locker != 1, table.account_id != 91)
-        total_row = query.count()
+        total_row = query.count() if counter is None else self.partition_count(counter, "feed", query)
+        order = (status_order, table.create_time.desc(), table.post_id.desc())
         if checkpoint == 0:
             start = checkpoint
-            items = query.order_by(status_order, table.create_time.desc()).offset(start).limit(size).all()
-            return {"items": items, "next_checkpoint": total_row - size}
+            items = query.order_by(*order).offset(start).limit(size).all()
+            next_checkpoint = total_row - size
         else:
             start = total_row - checkpoint
-            items = query.order_by(status_order, table.create_time.desc()).offset(start).limit(size).all()
+            items = query.order_by(*order).offset(start).limit(size).all()
             next_checkpoint = checkpoint - size
             if next_checkpoint < 1:
                 next_checkpoint = -1
-            return {"items": items, "next_checkpoint": next_checkpoint}
+        next_cursor = None
+        if items and next_checkpoint > 0:
+            last = items[-1]
+            next_cursor = encode_cursor(1 if last.status == 2 else 0, last.create_time, last.post_id)
+        return {"items": items, "next_checkpoint": next_checkpoint, "next_cursor": next_cursor}
+
+    def app_cursor_record(self, table: BaseModel, size: int, cursor: Optional[str] = None):
+        """
+        app_paging_record 와 같은 순서(거래완료 글은 뒤로, 최신순)를 (status_order, create_time, post_id) cursor 로 탐색
+        COUNT, OFFSET 없이 cursor 위치부터 바로 읽기 때문에 깊은 페이지도 첫 페이지와 비용이 같음
+        """
+        query = self.session.query(table).filter(table.use_locker != 1, table.account_id != 91)
+        last_order, last_key = 0, None
+        if cursor:
+            last_order, last_time, last_id = decode_cursor(cursor, int, datetime.fromisoformat, int)
+            last_key = (last_time, last_id)
 
-    def house_paging_record(self, table: BaseModel, size: int, checkpoint: int = 0):
+        items = []
+        # status_order 별로 나누어 읽으면 각 구간은 (create_time, post_id) 역순 탐색이 되어 인덱스를 그대로 사용할 수 있음
+        for status_order in (0, 1):
+            if status_order < last_order:
+                continue
+            part = query.filter(table.status == 2 if status_order else table.status != 2)
+            if last_key and status_order == last_order:
+                part = part.filter(tuple_(table.create_time, table.post_id) < last_key)
+            items += part.order_by(table.create_time.desc(), table.post_id.desc()).limit(size + 1 - len(items)).all()
+            if len(items) > size:
+                break
+
+        if len(items) <= size:
+            return {"items": items, "next_checkpoint": None, "next_cursor": None}
+        items = items[:size]
+        last = items[-1]
+        next_cursor = encode_cursor(1 if last.status == 2 else 0, last.create_time, last.post_id)
+        return {"items": items, "next_checkpoint": None, "next_cursor": next_cursor}
+
+    def house_paging_record(self, table: BaseModel, size: int, checkpoint: int = 0, counter: BaseModel = None):
         query = self.session.query(table).filter(table.use_locker != 1, table.account_id == 91)
-        total_row = query.count()
+        total_row = query.count() if counter is None else self.partition_count(counter, "house", query)
         if checkpoint == 0:
             start = checkpoint
             items = query.order_by(table.create_time.desc(), table.post_id.desc()).offset(start).limit(size).all()
@@ -120,9 +359,12 @@ class CRUD:
                 next_checkpoint = -1
             return {"items": items, "next_checkpoint": next_checkpoint}
 
-    def house_category_record(self, table: BaseModel, category: int, size: int, checkpoint: int = 0):
+    def house_category_record(self, table: BaseModel, category: int, size: int, checkpoint: int = 0, counter: BaseModel = None):
         query = self.session.query(table).filter(table.use_locker != 1, table.account_id == 91, table.category_id == category)
-        total_row = query.count()
+        if counter is None:
+            total_row = query.count()
+        else:
+            total_row = self.partition_count(counter, f"house:{category}", query)
         if checkpoint == 0:
             start = checkpoint
             items = query.order_by(table.create_time.desc(), table.post_id.desc()).offset(start).limit(size).all()
@@ -135,18 +377,217 @@ class CRUD:
                 next_checkpoint = -1
             return {"items": items, "next_checkpoint": next_checkpoint}
 
+    def text_search_record(self, table: BaseModel, fields: List[str], keyword: str, size: int, cursor: Optional[str] = None):
+        """
+        fields 를 대상으로 keyword 를 관련도순 검색, (score, primary key) cursor 로 이어서 가져옴
+        MySQL 은 FULLTEXT(ngram) index 의 MATCH 점수를, 그 외 DB 는 2-gram 일치 개수를 python 으로 계산한 점수를 사용
+        """
+        pk = inspect(table).primary_key[0]
+        last_key = decode_cursor(cursor, float, pk.type.python_type) if cursor else None
+        columns = [getattr(table, field) for field in fields]
+        dialect = self.session.get_bind().dialect
+
+        if dialect.name == "mysql" and not dialect.is_mariadb:
+            # MATCH 점수는 float 라서 그대로 == 로 비교하면 cursor 에 담긴 값과 어긋날 수 있으므로,
+            # 고정 자리수로 반올림한 값을 정렬과 (score, primary key) 비교에 같이 사용
+            relevance = match(*columns, against=keyword).in_natural_language_mode()
+            score = func.round(relevance, SCORE_PRECISION)
+            query = self.session.query(table, score).filter(relevance > 0)
+            if last_key:
+                query = query.filter(tuple_(score, pk) < tuple_(*last_key))
+            rows = query.order_by(score.desc(), pk.desc()).limit(size + 1).all()
+        else:
+            grams = ngrams(keyword)
+            if not grams:
+                return {"items": [], "next_cursor": None}
+            candidates = self.session.query(table).filter(or_(*[column.contains(gram) for column in columns for gram in grams])).all()
+            rows = []
+            for record in candidates:
+                texts = [getattr(record, field) or "" for field in fields]
+                rows.append((record, float(sum(text.count(gram) for text in texts for gram in grams))))
+            rows.sort(key=lambda row: (row[1], getattr(row[0], pk.key)), reverse=True)
+            if last_key:
+                rows = [row for row in rows if (row[1], getattr(row[0], pk.key)) < tuple(last_key)]
+            rows = rows[:size + 1]
+
+        items = [record for record, _ in rows[:size]]
+        next_cursor = None
+        if len(rows) > size:
+            record, score = rows[size - 1]
+            next_cursor = encode_cursor(float(score), getattr(record, pk.key))
+        return {"items": items, "next_cursor": next_cursor}
+
     def search_record(self, table: BaseModel, req: Union[BaseModel, dict]):
-        if isinstance(req, BaseModel):
-            req = req.dict()
-        filters = []
-        for key, value in req.items():
-            if value == 0 or value:
-                if isinstance(value, (int, float)):
-                    filters.append(getattr(table, key) == value)
-                elif isinstance(value, str):
-                    filters.append(getattr(table, key).contains(value))
-                elif isinstance(value, list):
-                    filters.append(func.json_contains(getattr(table, key), str(value)) == 1)
-
-        result = self.session.query(table).filter(*filters).all()
-        return result
+        signature, params = bind_params(legacy_conditions(req))
+        return self.session.execute(build_select(table, signature), params).scalars().all()
+
+    def filter_record(self, table: BaseModel, req: dict, fields: Dict[str, Set[str]], limit: int, cursor: Optional[str] = None):
+        """
+        API 에서 들어온 검색 조건을 fields 에 허용된 field, 연산자(eq, in, range, prefix, contains)로만 검색
+        primary key 순서로 limit 개씩 가져오고 다음 cursor 를 함께 반환, 잘못된 조건이나 cursor 면 ValueError
+        """
+        if not 0 < limit <= MAX_SEARCH_LIMIT:
+            raise ValueError(f"limit should be between 1 and {MAX_SEARCH_LIMIT}")
+        pk = inspect(table).primary_key[0]
+        signature, params = bind_params(parse_filters(req, fields))
+        params["limit"] = limit + 1
+        if cursor:
+            params["cursor"] = decode_cursor(cursor, pk.type.python_type)[0]
+        items = self.session.execute(build_select(table, signature, True, bool(cursor)), params).scalars().all()
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor(getattr(items[-1], pk.key))
+        return {"items": items, "next_cursor": next_cursor}
+
+    def search_in(self, table: BaseModel, key: str, values: list):
+        """
+        key 의 값이 values 중 하나인 record 들을 한 번에 조회
+        """
+        if not values:
+            return []
+        return self.session.query(table).filter(getattr(table, key).in_(values)).all()
+
+    def latest_per_group(self, table: BaseModel, group_key: str, values: list) -> dict:
+        """
+        group_key 의 값이 values 중 하나인 그룹마다 primary key 가 가장 큰 record 를 {그룹 값: record} 로 반환
+        그룹별 MAX(primary key) 를 구해 join 하므로 그룹의 record 를 모두 읽지 않음
+        """
+        if not values:
+            return {}
+        pk = inspect(table).primary_key[0].key
+        group = getattr(table, group_key)
+        latest = (
+            select(func.max(getattr(table, pk)).label("latest_id"))
+            .where(group.in_(values))
+            .group_by(group)
+            .subquery()
+        )
+        records = self.session.query(table).join(latest, getattr(table, pk) == latest.c.latest_id).all()
+        return {getattr(record, group_key): record for record in records}
+
+    def count_group(self, table: BaseModel, group_keys: List[str], key: str, values: list, cond={}) -> dict:
+        """
+        key 의 값이 values 중 하나이고 cond 를 만족하는 record 수를 group_keys 별로 세어 {(그룹 값들): 개수} 로 반환
+        """
+        if not values:
+            return {}
+        groups = [getattr(table, group_key) for group_key in group_keys]
+        filters = [getattr(table, k) == v for k, v in cond.items()]
+        rows = (
+            self.session.query(*groups, func.count())
+            .filter(getattr(table, key).in_(values), *filters)
+            .group_by(*groups)
+            .all()
+        )
+        return {tuple(row[:-1]): row[-1] for row in rows}
+
+    def seek_record(self, table: BaseModel, cond: dict, size: Optional[int], before: Optional[int] = None, after: Optional[int] = None) -> list:
+        """
+        cond 에 맞는 record 중 size 개(None 이면 전부)를 primary key 오름차순으로 반환
+        after 가 있으면 after 다음 record 부터, 아니면 before(없으면 가장 최근) 직전의 가장 최근 record 들을 가져옴
+        """
+        pk = getattr(table, inspect(table).primary_key[0].key)
+        filters = [getattr(table, key) == value for key, value in cond.items()]
+        query = self.session.query(table).filter(*filters)
+        if after is not None:
+            return query.filter(pk > after).order_by(pk).limit(size).all()
+        if before is not None:
+            query = query.filter(pk < before)
+        return query.order_by(pk.desc()).limit(size).all()[::-1]
+
+    def upsert_max(self, table: BaseModel, keys: dict, column: str, value) -> None:
+        """
+        keys 로 찾은 record 의 column 값을 value 와 기존 값 중 큰 값으로 저장, record 가 없으면 생성
+        읽지 않고 INSERT ... ON DUPLICATE KEY UPDATE (SQLite 는 ON CONFLICT) 한 문장으로 처리
+        """
+        dialect = self.session.get_bind().dialect.name
+        row = {**keys, column: value}
+        if dialect in ("mysql", "mariadb"):
+            stmt = mysql_insert(table).values(row)
+            stmt = stmt.on_duplicate_key_update({column: func.greatest(getattr(table, column), stmt.inserted[column])})
+        else:
+            stmt = sqlite_insert(table).values(row)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(keys), set_={column: func.max(getattr(table, column), stmt.excluded[column])}
+            )
+        self.session.execute(stmt)
+        self._commit()
+
+    def count_after(self, table: BaseModel, group_keys: List[str], key: str, values: list, watermark, owner: dict, fallback=None) -> dict:
+        """
+        key 의 값이 values 중 하나인 record 중에서 watermark column 에 저장된 값보다 primary key 가 큰 record 수를 group_keys 별로 반환
+        watermark 의 table 은 owner 조건과 key 로 join 되고, watermark record 가 없는 그룹은 fallback 조건으로 셈 (없으면 전부)
+        """
+        if not values:
+            return {}
+        state = watermark.class_
+        pk = getattr(table, inspect(table).primary_key[0].key)
+        groups = [getattr(table, group_key) for group_key in group_keys]
+        onclause = and_(getattr(state, key) == getattr(table, key), *[getattr(state, k) == v for k, v in owner.items()])
+        if fallback is None:
+            after = pk > func.coalesce(watermark, 0)
+        else:
+            after = or_(pk > watermark, and_(watermark.is_(None), fallback))
+        rows = (
+            self.session.query(*groups, func.count())
+            .select_from(table)
+            .outerjoin(state, onclause)
+            .filter(getattr(table, key).in_(values), after)
+            .group_by(*groups)
+            .all()
+        )
+        return {tuple(row[:-1]): row[-1] for row in rows}
+
+    def join_seek_record(self, table: BaseModel, joins: list, criteria: list, keys: list, size: int, cursor: Optional[str], *columns):
+        """
+        table 을 joins 의 (table, 조건) 들과 LEFT OUTER JOIN 하고 criteria 로 거른 뒤 keys 내림차순으로 size 개의 columns 를 가져옴
+        cursor 가 있으면 그 키 다음부터 가져오고 다음 cursor 를 함께 반환, 잘못된 cursor 면 ValueError
+        """
+        seek_keys = [key.label(f"seek_key{idx}") for idx, key in enumerate(keys)]
+        query = self.session.query(*columns, *seek_keys).select_from(table)
+        for target, onclause in joins:
+            query = query.outerjoin(target, onclause)
+        query = query.filter(*criteria)
+        if cursor:
+            values = decode_cursor(cursor, *[key.type.python_type for key in keys])
+            query = query.filter(tuple_(*keys) < tuple_(*values))
+        rows = query.order_by(*[key.desc() for key in keys]).limit(size + 1).all()
+
+        next_cursor = None
+        if len(rows) > size:
+            rows = rows[:size]
+            next_cursor = encode_cursor(*[getattr(rows[-1], key.name) for key in seek_keys])
+        return {"items": rows, "next_cursor": next_cursor}
+
+    def join_record(self, table: BaseModel, joins: list, key: str, values: list, *columns) -> list:
+        """
+        key 의 값이 values 중 하나인 table 의 row 들을 joins 의 (table, 조건) 들과 LEFT OUTER JOIN 해서 columns 만 한 번에 조회
+        join 대상이 없으면 해당 column 들은 None 으로 채워짐
+        """
+        if not values:
+            return []
+        query = self.session.query(*columns).select_from(table)
+        for target, onclause in joins:
+            query = query.outerjoin(target, onclause)
+        return query.filter(getattr(table, key).in_(values)).all()
+
+
+class AsyncCRUD:
+    """
+    CRUD 와 같은 method 들을 AsyncSession 위에서 await 로 사용
+    각 method 는 CRUD 의 같은 method 를 run_sync 로 실행하므로 동작은 같고, DB 를 기다리는 동안 event loop 를 막지 않음
+    """
+    def __init__(self, session: AsyncSession, unit_of_work: bool = False) -> None:
+        self.session = session
+        self.unit_of_work = unit_of_work
+
+    def __getattr__(self, name):
+        if not callable(getattr(CRUD, name, None)) or name.startswith("_"):
+            raise AttributeError(name)
+
+        async def method(*args, **kwargs):
+            return await self.session.run_sync(lambda session: getattr(CRUD(session, self.unit_of_work), name)(*args, **kwargs))
+        method.__name__ = name
+        return method
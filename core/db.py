@@ -1,4 +1,6 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from os import environ
@@ -9,4 +11,19 @@ engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_recycle=7200, pool_size=15,
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# async endpoint 용 engine, 따로 지정하지 않으면 같은 DB 에 async driver(aiomysql, 로컬 sqlite 는 aiosqlite)로 접속
+ASYNC_DRIVERS = {"mysql": "mysql+aiomysql", "mariadb": "mariadb+aiomysql", "sqlite": "sqlite+aiosqlite"}
+if environ.get("SQLALCHEMY_ASYNC_DATABASE_URL"):
+    SQLALCHEMY_ASYNC_DATABASE_URL = make_url(environ["SQLALCHEMY_ASYNC_DATABASE_URL"])
+else:
+    _url = make_url(SQLALCHEMY_DATABASE_URL)
+    SQLALCHEMY_ASYNC_DATABASE_URL = _url.set(drivername=ASYNC_DRIVERS[_url.get_backend_name()])
+if SQLALCHEMY_ASYNC_DATABASE_URL.get_backend_name() == "sqlite":
+    async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL)  # aiosqlite 는 pool 을 사용하지 않음
+else:
+    async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, pool_recycle=7200, pool_size=15, max_overflow=20)
+
+# 반환된 객체를 commit 이후에 다시 읽으면 event loop 밖에서 SELECT 가 일어나므로 expire 하지 않음
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
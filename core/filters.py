@@ -0,0 +1,144 @@
+from functools import lru_cache
+from typing import Dict, List, Set, Tuple, Union
+
+from pydantic import BaseModel
+from sqlalchemy import Integer, bindparam, func, inspect, select
+
+"""
+/search API 들의 filter 조건을 검증하고 SQL 문으로 만드는 모듈
+"""
+
+INT_OPS = {"eq", "in", "range"}
+STR_OPS = {"eq", "in", "prefix", "contains"}
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _is_scalar(value) -> bool:
+    return isinstance(value, (bool, int, float, str))
+
+
+def infer_op(value) -> str:
+    """
+    연산자 없이 값만 들어온 조건의 연산자, 문자열은 contains, 숫자는 eq 로 기존 search_record 와 같음
+    리스트는 기존 search_record 에서 json_contains 였지만 /search 로 검색할 수 있는 field 중 JSON column 이 없어서
+    항상 실패하던 조건이므로, 리스트 중 하나와 같은 값(in)으로 바뀜
+    """
+    if isinstance(value, str):
+        return "contains"
+    if isinstance(value, list):
+        return "in"
+    return "eq"
+
+
+def parse_filters(req: dict, fields: Dict[str, Set[str]]) -> List[Tuple[str, str, object]]:
+    """
+    {"title": "짱구", "price": {"range": [0, 10000]}, "status": {"in": [0, 1]}} 형태의 조건을
+    (field, op, value) 리스트로 변환, 허용되지 않은 field 나 연산자면 ValueError
+    """
+    conditions = []
+    for key, value in req.items():
+        if key not in fields:
+            raise ValueError(f"Unsupported field: {key}")
+        if isinstance(value, dict):
+            if len(value) != 1:
+                raise ValueError(f"Only one operator is allowed for {key}")
+            op, value = next(iter(value.items()))
+        else:
+            if not (value == 0 or value):
+                continue
+            op = infer_op(value)
+        if op not in fields[key]:
+            raise ValueError(f"Unsupported operator for {key}: {op}")
+        if op == "eq" and not _is_scalar(value):
+            raise ValueError(f"{key}: eq operator needs a single value")
+        if op == "in" and (not isinstance(value, list) or not value or not all(_is_scalar(v) for v in value)):
+            raise ValueError(f"{key}: in operator needs a non-empty list of values")
+        if op == "range" and (
+            not isinstance(value, list) or len(value) != 2 or value == [None, None]
+            or not all(v is None or _is_scalar(v) for v in value)
+        ):
+            raise ValueError(f"{key}: range operator needs [min, max]")
+        if op in ("prefix", "contains") and not isinstance(value, str):
+            raise ValueError(f"{key}: {op} operator needs a string")
+        conditions.append((key, op, value))
+    return conditions
+
+
+def bind_params(conditions: List[Tuple[str, str, object]]) -> Tuple[tuple, dict]:
+    """
+    조건 리스트를 statement 모양(signature)과 bind parameter 값으로 분리
+    값만 다르고 모양이 같은 검색은 같은 statement 를 재사용함
+    """
+    signature = []
+    params = {}
+    for idx, (key, op, value) in enumerate(conditions):
+        name = f"p{idx}"
+        if op == "range":
+            low, high = value
+            signature.append((key, op, low is not None, high is not None))
+            params[f"{name}_low"] = low
+            params[f"{name}_high"] = high
+            continue
+        signature.append((key, op))
+        if op == "prefix":
+            params[name] = _escape_like(value) + "%"
+        elif op == "contains":
+            params[name] = "%" + _escape_like(value) + "%"
+        elif op == "json_contains":
+            params[name] = str(value)
+        else:
+            params[name] = value
+    return tuple(signature), params
+
+
+@lru_cache(maxsize=512)
+def build_select(table, signature: tuple, paged: bool = False, after: bool = False):
+    """
+    signature 모양의 select 문을 한 번만 만들어 두고 재사용, 값은 모두 bind parameter 로 전달
+    paged 이면 primary key 순서로 limit 개를 가져오고, after 이면 cursor 의 primary key 다음부터 가져옴
+    """
+    stmt = select(table)
+    for idx, cond in enumerate(signature):
+        key, op = cond[0], cond[1]
+        column = getattr(table, key)
+        name = f"p{idx}"
+        if op == "eq":
+            stmt = stmt.where(column == bindparam(name))
+        elif op == "in":
+            stmt = stmt.where(column.in_(bindparam(name, expanding=True)))
+        elif op == "range":
+            if cond[2]:
+                stmt = stmt.where(column >= bindparam(f"{name}_low"))
+            if cond[3]:
+                stmt = stmt.where(column <= bindparam(f"{name}_high"))
+        elif op in ("prefix", "contains"):
+            stmt = stmt.where(column.like(bindparam(name), escape="\\"))
+        elif op == "json_contains":
+            stmt = stmt.where(func.json_contains(column, bindparam(name)) == 1)
+    if paged:
+        pk = inspect(table).primary_key[0]
+        if after:
+            stmt = stmt.where(pk > bindparam("cursor"))
+        stmt = stmt.order_by(pk).limit(bindparam("limit", type_=Integer))
+    return stmt
+
+
+def legacy_conditions(req: Union[BaseModel, dict]) -> List[Tuple[str, str, object]]:
+    """
+    내부에서 쓰는 search_record 의 조건 변환, 검증 없이 기존 규칙(int=eq, str=contains, list=json_contains)을 따름
+    """
+    if isinstance(req, BaseModel):
+        req = req.dict()
+    conditions = []
+    for key, value in req.items():
+        if value == 0 or value:
+            if isinstance(value, (int, float)):
+                conditions.append((key, "eq", value))
+            elif isinstance(value, str):
+                conditions.append((key, "contains", value))
+            elif isinstance(value, list):
+                conditions.append((key, "json_contains", value))
+    return conditions
@@ -0,0 +1,77 @@
+import asyncio
+import io
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from os import environ
+from typing import Dict, Tuple
+
+"""
+게시물 사진의 작은 크기 변형(thumbnail, medium)을 만드는 모듈
+이미지 변환은 CPU 작업이라 event loop 나 업로드 thread 가 아닌 별도 process pool 에서 실행
+변형은 다시 encode 하면서 EXIF(위치 정보 등)를 모두 버리고, 회전 정보만 픽셀에 반영함
+"""
+
+# 변형 이름과 긴 변의 최대 길이(px)
+VARIANTS = {"thumbnail": 200, "medium": 800}
+VARIANT_FORMAT = environ.get("IMAGE_VARIANT_FORMAT", "WEBP").upper()
+VARIANT_QUALITY = int(environ.get("IMAGE_VARIANT_QUALITY", 80))
+IMAGE_WORKERS = int(environ.get("IMAGE_WORKERS", 2))
+# 변형을 만들 원본의 최대 크기(byte), 더 큰 사진은 변형 없이 원본만 사용
+MAX_SOURCE_SIZE = int(environ.get("IMAGE_VARIANT_MAX_SOURCE", 10 * 1024 * 1024))
+
+CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+EXTENSIONS = {"WEBP": ".webp", "JPEG": ".jpg"}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    처음 사용할 때 process pool 을 만듦, import 시점에 만들면 서버 worker 를 fork 하기 전에 process 가 생김
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _pool
+
+
+def resize(data: bytes, variant_format: str = VARIANT_FORMAT) -> Dict[str, bytes]:
+    """
+    원본 이미지 bytes 로 VARIANTS 의 크기별 이미지를 만들어 {이름: bytes} 로 반환, process pool 에서 실행됨
+    원본보다 큰 변형은 만들지 않고 원본 크기 그대로 encode 함
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if variant_format == "JPEG" or image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        variants = {}
+        for name, size in VARIANTS.items():
+            variant = image.copy()
+            variant.thumbnail((size, size))
+            out = io.BytesIO()
+            variant.save(out, format=variant_format, quality=VARIANT_QUALITY, optimize=True)
+            variants[name] = out.getvalue()
+    return variants
+
+
+async def make_variants(data: bytes) -> Dict[str, Tuple[bytes, str]]:
+    """
+    process pool 에서 변형을 만들고 {이름: (bytes, content type)} 으로 반환
+    """
+    loop = asyncio.get_running_loop()
+    variants = await loop.run_in_executor(get_pool(), resize, data, VARIANT_FORMAT)
+    return {name: (body, CONTENT_TYPES[VARIANT_FORMAT]) for name, body in variants.items()}
+
+
+def variant_key(key: str, name: str) -> str:
+    """
+    post/abc.jpg -> post/abc_thumbnail.webp
+    """
+    base, _ = os.path.splitext(key)
+    return f"{base}_{name}{EXTENSIONS[VARIANT_FORMAT]}"
@@ -0,0 +1,41 @@
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+"""
+요청 body 크기 제한 middleware
+Content-Length 가 제한보다 크면 body 를 읽기 전에 413 으로 거절하고,
+Content-Length 가 없거나 틀린 요청은 읽는 도중 제한을 넘는 순간 413 으로 중단
+"""
+
+
+class BodySizeLimitMiddleware:
+    def __init__(self, app: ASGIApp, max_size: int) -> None:
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_size:
+            response = JSONResponse(
+                {"detail": f"Request body is larger than {self.max_size} bytes"}, status_code=413,
+                headers={"Connection": "close"},
+            )
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    # form 을 읽는 router 안에서 발생하므로 exception handler 가 413 응답으로 바꿈
+                    raise HTTPException(status_code=413, detail=f"Request body is larger than {self.max_size} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
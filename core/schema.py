@@ -1,5 +1,45 @@
+from typing import Dict, Optional, Set
+
+from fastapi import Query
 from pydantic import BaseModel
 
+MAX_SEARCH_LIMIT = 100
+# /search API 들의 limit query, 범위 밖이면 FastAPI 가 422 로 거절
+SEARCH_LIMIT = Query(MAX_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT, description=f"한 번에 가져올 개수, 최대 {MAX_SEARCH_LIMIT}")
+
+# /page-list API description 끝에 붙이는 deprecated 안내
+PAGE_LIST_DEPRECATED = "\n\n**Deprecated**: 페이지가 깊어질수록 느려지므로 cursor-list를 사용해주세요."
+
+
+def search_description(fields: Dict[str, Set[str]]) -> str:
+    """
+    각 router 의 /search API description, fields 는 router 의 SEARCH_FIELDS
+    """
+    field_list = ", ".join(f"{name}({', '.join(sorted(ops))})" for name, ops in fields.items())
+    return (
+        "body에 {필드: 조건값}을 넣으면 모든 조건을 and로 필터한 결과 리스트를 반환합니다. 원하는 필드만 넣어서 검색할 수 있습니다.\n\n"
+        "조건값이 str 이면 그 문자열을 포함하는(contains), int, float 이면 그 값과 같은(eq), "
+        "list 이면 list 항목 중 하나와 같은(in) record를 반환합니다.\n\n"
+        "조건값에 {\"연산자\": 값}을 넣으면 eq(같음), in(리스트 중 하나), range([최소, 최대], null은 제한 없음), "
+        "prefix(문자열로 시작), contains(문자열 포함) 연산자를 직접 지정할 수 있습니다.\n\n"
+        f"검색 가능한 필드(사용 가능한 연산자): {field_list}\n\n"
+        f"한 번에 최대 limit(query, 기본 {MAX_SEARCH_LIMIT})개를 id 순서로 반환하며, 더 남아있으면 응답 헤더 X-Next-Cursor 값을 "
+        "다음 요청의 cursor query로 넣어 이어서 가져올 수 있습니다."
+    )
+
+
+def cursor_list_description(table: str) -> str:
+    """
+    각 router 의 /cursor-list API description
+    """
+    return (
+        f"{table} 테이블의 Record list를 cursor 방식으로 가져오는 API입니다.\n\n"
+        "최신순으로 size개 만큼 가져오며, 응답의 next_cursor를 다음 요청의 cursor로 넣으면 이어서 가져옵니다. "
+        "첫 요청은 cursor 없이 보내면 되고, 마지막 페이지에서는 next_cursor가 null로 반환됩니다.\n\n"
+        "page-list와 달리 페이지가 깊어져도 응답 속도가 같습니다. 전체 개수가 필요하면 with_total을 true로 보내면 됩니다.\n\n"
+        "Size는 100개로 제한됩니다."
+    )
+
 
 class RequestPage(BaseModel):
     page: int
@@ -7,3 +47,12 @@ class RequestPage(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class RequestCursor(BaseModel):
+    size: int
+    cursor: Optional[str] = None
+    with_total: bool = False
+
+    class Config:
+        orm_mode = True
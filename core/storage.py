@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from os import environ
+from typing import Iterable, Optional
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+"""
+S3 업로드 모듈, 프로세스 전체에서 boto3 client 하나와 업로드용 thread pool 하나를 공유
+boto3 의 업로드는 blocking 이라 event loop 밖의 thread 에서 실행하고 await 로 기다림
+"""
+
+S3_BUCKET = environ.get("S3_BUCKET", "dangmuzi-photo")
+S3_REGION = environ.get("S3_REGION", "ap-northeast-2")
+# MinIO, moto server 같은 로컬 S3 를 쓸 때만 설정, 없으면 AWS S3
+S3_ENDPOINT_URL = environ.get("S3_ENDPOINT_URL")
+# presigned url 의 유효 시간(초)
+PRESIGN_EXPIRES = int(environ.get("S3_PRESIGN_EXPIRES", 600))
+# 동시에 실행되는 업로드 수, client 의 connection pool 도 같은 크기로 잡아서 connection 을 기다리지 않게 함
+UPLOAD_WORKERS = int(environ.get("S3_UPLOAD_WORKERS", 16))
+# 요청 하나가 동시에 올리는 파일 수, 사진이 많은 요청 하나가 thread pool 을 다 차지하지 않게 함
+REQUEST_UPLOADS = int(environ.get("S3_REQUEST_UPLOADS", 4))
+# 파일 하나의 최대 크기와 요청 body 전체의 최대 크기(byte)
+MAX_UPLOAD_SIZE = int(environ.get("S3_MAX_UPLOAD_SIZE", 20 * 1024 * 1024))
+MAX_REQUEST_SIZE = int(environ.get("MAX_REQUEST_SIZE", 100 * 1024 * 1024))
+# 한 번에 읽어서 올리는 크기, S3 multipart upload 의 최소 part 크기가 5MB 라서 그보다 작게 잡을 수 없음
+PART_SIZE = max(int(environ.get("S3_PART_SIZE", 5 * 1024 * 1024)), 5 * 1024 * 1024)
+
+# 파일 앞부분의 magic byte 로 판별하는 이미지 형식
+IMAGE_SIGNATURES = [
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (8, b"WEBP", "image/webp"),
+    (4, b"ftypheic", "image/heic"),
+    (4, b"ftypheix", "image/heic"),
+    (4, b"ftypmif1", "image/heif"),
+    (4, b"ftyphevc", "image/heic"),
+]
+
+_client = None
+_client_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="s3-upload")
+
+
+def get_client():
+    """
+    처음 사용할 때 한 번만 client 를 만들어서 재사용, boto3 client 는 여러 thread 에서 같이 써도 됨
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = boto3.client(
+                    service_name="s3",
+                    region_name=S3_REGION,
+                    endpoint_url=S3_ENDPOINT_URL,
+                    aws_access_key_id=environ.get("S3_ACCESS"),
+                    aws_secret_access_key=environ.get("S3_SECRET"),
+                    config=Config(max_pool_connections=UPLOAD_WORKERS, retries={"mode": "standard"}),
+                )
+    return _client
+
+
+class FileTooLarge(ValueError):
+    pass
+
+
+class UnsupportedFile(ValueError):
+    pass
+
+
+def sniff(head: bytes) -> Optional[str]:
+    """
+    파일 앞부분으로 이미지 content type 을 판별, 지원하지 않는 형식이면 None
+    """
+    for offset, signature, content_type in IMAGE_SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            if content_type == "image/webp" and head[:4] != b"RIFF":
+                continue
+            return content_type
+    return None
+
+
+def public_url(key: str) -> str:
+    if S3_ENDPOINT_URL:
+        return f"{S3_ENDPOINT_URL.rstrip('/')}/{S3_BUCKET}/{key}"
+    return f"https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/{key}"
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """
+    blocking 인 S3 호출을 업로드용 thread pool 에서 실행하고 결과를 기다림
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+def _stream(fileobj, key: str, max_size: int):
+    """
+    fileobj 를 PART_SIZE 씩 읽어서 올림, 메모리에는 part 하나만 올라옴
+    첫 part 로 형식을 확인하고 읽은 크기가 max_size 를 넘으면 그 자리에서 중단
+    """
+    client = get_client()
+    chunk = fileobj.read(PART_SIZE)
+    content_type = sniff(chunk)
+    if content_type is None:
+        raise UnsupportedFile("Unsupported image format")
+    if len(chunk) > max_size:
+        raise FileTooLarge(f"File is larger than {max_size} bytes")
+    if len(chunk) < PART_SIZE:
+        # part 하나로 끝나는 작은 파일은 multipart upload 없이 한 번에 올림
+        client.put_object(Bucket=S3_BUCKET, Key=key, Body=chunk, ContentType=content_type)
+        return
+
+    upload_id = client.create_multipart_upload(Bucket=S3_BUCKET, Key=key, ContentType=content_type)["UploadId"]
+    try:
+        parts = []
+        size = 0
+        while chunk:
+            size += len(chunk)
+            if size > max_size:
+                raise FileTooLarge(f"File is larger than {max_size} bytes")
+            part_number = len(parts) + 1
+            etag = client.upload_part(
+                Bucket=S3_BUCKET, Key=key, UploadId=upload_id, PartNumber=part_number, Body=chunk
+            )["ETag"]
+            parts.append({"ETag": etag, "PartNumber": part_number})
+            chunk = fileobj.read(PART_SIZE)
+        client.complete_multipart_upload(
+            Bucket=S3_BUCKET, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except BaseException:
+        # 올리던 part 들이 S3 에 남지 않도록 중단
+        client.abort_multipart_upload(Bucket=S3_BUCKET, Key=key, UploadId=upload_id)
+        raise
+
+
+async def put(body: bytes, key: str, content_type: str) -> str:
+    """
+    서버에서 만든 작은 파일(사진 변형 등)을 한 번에 올리고 공개 url 을 반환
+    """
+    await run_in_pool(get_client().put_object, Bucket=S3_BUCKET, Key=key, Body=body, ContentType=content_type)
+    return public_url(key)
+
+
+def _read(key: str) -> bytes:
+    return get_client().get_object(Bucket=S3_BUCKET, Key=key)["Body"].read()
+
+
+async def read(key: str) -> bytes:
+    """
+    key 의 object 전체를 읽음, presigned 업로드 확인 후 변형을 만들 때 사용
+    """
+    return await run_in_pool(_read, key)
+
+
+def key_of(url: str) -> str:
+    """
+    public_url 로 만든 url 에서 object key 를 꺼냄
+    """
+    path = url.split("/", 3)[3]
+    if S3_ENDPOINT_URL:
+        path = path[len(S3_BUCKET) + 1:]
+    return path
+
+
+def sha256(fileobj) -> str:
+    """
+    fileobj 를 PART_SIZE 씩 읽어서 SHA-256 을 계산하고 처음 위치로 되돌림, 업로드용 thread pool 에서 실행
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(partial(fileobj.read, PART_SIZE), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def _delete(keys: list):
+    client = get_client()
+    for key in keys:
+        client.delete_object(Bucket=S3_BUCKET, Key=key)
+
+
+def delete_later(keys: Iterable[str]):
+    """
+    object 들을 업로드용 thread pool 에서 지움, 결과를 기다리지 않으므로 commit 후 callback 에서도 사용할 수 있음
+    """
+    keys = list(dict.fromkeys(keys))
+    if keys:
+        _executor.submit(_delete, keys)
+
+
+def presign_post(key: str, max_size: int = MAX_UPLOAD_SIZE) -> dict:
+    """
+    클라이언트가 key 로 직접 올릴 수 있는 presigned POST, {"url": ..., "fields": {...}}
+    POST policy 로 크기와 Content-Type 을 제한할 수 있어서 PUT 대신 사용
+    """
+    return get_client().generate_presigned_post(
+        Bucket=S3_BUCKET,
+        Key=key,
+        Conditions=[["content-length-range", 1, max_size], ["starts-with", "$Content-Type", "image/"]],
+        ExpiresIn=PRESIGN_EXPIRES,
+    )
+
+
+def _verify(key: str, max_size: int) -> str:
+    """
+    클라이언트가 올린 object 가 있는지, 크기와 형식이 맞는지 확인
+    조건에 맞지 않는 object 는 지우고 FileNotFoundError, FileTooLarge, UnsupportedFile 중 하나를 발생
+    """
+    client = get_client()
+    try:
+        head = client.head_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            raise FileNotFoundError(key)
+        raise
+    try:
+        if head["ContentLength"] > max_size:
+            raise FileTooLarge(f"File is larger than {max_size} bytes")
+        first = client.get_object(Bucket=S3_BUCKET, Key=key, Range="bytes=0-15")["Body"].read()
+        if sniff(first) is None:
+            raise UnsupportedFile("Unsupported image format")
+    except ValueError:
+        client.delete_object(Bucket=S3_BUCKET, Key=key)
+        raise
+    return public_url(key)
+
+
+async def verify(key: str, max_size: int = MAX_UPLOAD_SIZE) -> str:
+    """
+    클라이언트가 직접 올린 object 를 확인하고 공개 url 을 반환
+    """
+    return await run_in_pool(_verify, key, max_size)
+
+
+async def upload(fileobj, key: str, max_size: int = MAX_UPLOAD_SIZE) -> str:
+    """
+    fileobj 를 key 로 업로드하고 공개 url 을 반환
+    이미지가 아니면 UnsupportedFile, max_size 보다 크면 FileTooLarge
+    """
+    await run_in_pool(_stream, fileobj, key, max_size)
+    return public_url(key)
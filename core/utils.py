@@ -1,5 +1,5 @@
-from core.crud import CRUD
-from core.db import SessionLocal
+from core.crud import CRUD, AsyncCRUD
+from core.db import SessionLocal, AsyncSessionLocal
 
 
 def get_crud():
@@ -10,9 +10,34 @@ def get_crud():
         db.close()
 
 
+def get_uow_crud():
+    """
+    요청 하나를 한 transaction 으로 처리하는 CRUD, method 들은 flush 만 하고 요청이 끝날 때 한 번 commit
+    예외가 나면 전체를 rollback 하고, commit 후에도 반환한 객체를 다시 SELECT 하지 않도록 expire_on_commit 을 끔
+    FastAPI 0.103 에서는 dependency 종료가 응답을 보낸 뒤에 실행되므로, 저장 실패를 응답에 반영하려면 endpoint 에서 crud.commit() 을 호출
+    """
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        yield CRUD(db, unit_of_work=True)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_crud():
+    db = AsyncSessionLocal()
+    try:
+        yield AsyncCRUD(db)
+    finally:
+        await db.close()
@@ -1,4 +1,4 @@
-from sqlalchemy import VARCHAR, Column, Integer, TEXT, text, CHAR
+from sqlalchemy import VARCHAR, Column, Integer, TEXT, text, CHAR, Index
 from sqlalchemy.dialects.mysql import TINYINT
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import TypeDecorator, TIMESTAMP
@@ -50,6 +50,10 @@ class Account(Base):
 
     mysql_engine = "InnoDB"
 
+    __table_args__ = (
+        Index("ix_account_create_time_account_id", "create_time", "account_id"),  # cursor-list 탐색용
+    )
+
     def to_dict(self):
         return {
             "account_id": self.account_id,
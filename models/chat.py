@@ -1,9 +1,12 @@
-from sqlalchemy import Column, Integer, text, TEXT, ForeignKey, String, Null
+from sqlalchemy import Column, Integer, text, TEXT, JSON, ForeignKey, String, Null, Index, event
 from sqlalchemy.dialects.mysql import TINYINT
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, Session
 from sqlalchemy.types import TIMESTAMP
+import ast
 import uuid
+from functools import partial
 
+from core.broker import broker, room_channel
 from core.db import Base
 
 
@@ -31,9 +34,16 @@ class Message(Base):
     is_photo = Column(TINYINT, default=0)
     content = Column(TEXT, nullable=False)
     read = Column(TINYINT, default=0)
+    photo_urls = Column(JSON(none_as_null=True), comment="사진 메시지의 url 리스트, Null: 사진 메시지가 아니거나 backfill 전의 예전 메시지")
     create_time = Column(TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP"))
     mysql_engine = "InnoDB"
 
+    __table_args__ = (
+        Index("ix_message_room_id_message_id", "room_id", "message_id"),  # 채팅방 메시지 페이지 탐색용
+    )
+    # INSERT 직후 create_time 을 읽어 와서 WebSocket 알림에 바로 담음
+    __mapper_args__ = {"eager_defaults": True}
+
     def to_dict(self):
         return {
             "message_id": self.message_id,
@@ -43,4 +53,93 @@ class Message(Base):
             "content": self.content,
             "read": self.read,
             "create_time": self.create_time,
-        }
\ No newline at end of file
+        }
+
+    def payload(self):
+        """
+        응답에 내보낼 content, 사진 메시지면 url 리스트
+        photo_urls 가 채워지기 전의 예전 사진 메시지만 content 에 저장된 리스트 문자열을 해석함
+        """
+        if not self.is_photo or self.content == "img":
+            return self.content
+        if self.photo_urls is not None:
+            return self.photo_urls
+        return ast.literal_eval(self.content)
+
+    def to_event(self) -> dict:
+        """
+        WebSocket 으로 보낼 메시지, RecordChat 과 같은 field 에 room_id 를 더함
+        """
+        return {
+            "message_id": self.message_id,
+            "room_id": self.room_id,
+            "is_from_buyer": self.is_from_buyer,
+            "is_photo": self.is_photo,
+            "content": self.payload(),
+            "read": self.read or 0,
+            "create_time": self.create_time.isoformat() if self.create_time else None,
+        }
+
+
+class MessageArchive(Base):
+    """
+    오래 활동이 없는 닫힌 채팅방(나간 방, 거래 완료된 게시물의 방)의 메시지를 옮겨 두는 table
+    scripts/archive_messages.py 가 message 에서 옮기고, 채팅 조회 API 는 message 에 없는 부분을 여기서 읽음
+    """
+    __tablename__ = "message_archive"
+    message_id = Column(Integer, nullable=False, autoincrement=False, primary_key=True)
+    room_id = Column(String(36), nullable=False)
+    is_from_buyer = Column(TINYINT, nullable=False)
+    is_photo = Column(TINYINT, default=0)
+    content = Column(TEXT, nullable=False)
+    read = Column(TINYINT, default=0)
+    photo_urls = Column(JSON(none_as_null=True))
+    create_time = Column(TIMESTAMP, nullable=False)
+    archived_time = Column(TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP"))
+    mysql_engine = "InnoDB"
+
+    __table_args__ = (
+        Index("ix_message_archive_room_id_message_id", "room_id", "message_id"),
+    )
+
+    payload = Message.payload
+
+
+@event.listens_for(Session, "after_flush")
+def publish_new_messages(session, flush_context):
+    """
+    새로 저장된 메시지를 commit 된 뒤에 채팅방 channel 을 구독 중인 WebSocket 들에게 전달
+    전달을 예약한 message_id 는 published_message_ids 에 남겨서, ORM 을 거치지 않은 INSERT 만 따로 전달하게 함
+    """
+    messages = [message for message in session.new if isinstance(message, Message)]
+    if messages:
+        session.info.setdefault("on_commit", []).extend(
+            partial(broker.publish, room_channel(message.room_id), message.to_event()) for message in messages
+        )
+        session.info.setdefault("published_message_ids", set()).update(message.message_id for message in messages)
+
+
+@event.listens_for(Session, "after_commit")
+def clear_published_messages(session):
+    session.info.pop("published_message_ids", None)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def discard_published_messages(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("published_message_ids", None)
+
+
+class RoomReadState(Base):
+    """
+    채팅방 참여자별로 어디까지 읽었는지(last_read_message_id) 저장
+    이 값보다 큰 message_id 의 상대방 메시지가 안읽은 메시지
+    """
+    __tablename__ = "room_read_state"
+    room_id = Column(String(36), ForeignKey("room.room_id"), primary_key=True)
+    account_id = Column(Integer, ForeignKey("account.account_id"), primary_key=True)
+    last_read_message_id = Column(Integer, nullable=False, default=0)
+    update_time = Column(
+        TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")
+    )
+    mysql_engine = "InnoDB"
@@ -1,5 +1,5 @@
 from sqlalchemy.types import TIMESTAMP
-from sqlalchemy import Column, Integer, ForeignKey, text
+from sqlalchemy import Column, Integer, ForeignKey, UniqueConstraint, text
 
 from core.db import Base
 
@@ -10,4 +10,8 @@ class Liked(Base):
     post_id = Column(Integer, ForeignKey("post.post_id"), nullable=False)
     account_id = Column(Integer, ForeignKey("account.account_id"), nullable=False)
     create_time = Column(TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP"))
-    mysql_engine = "InnoDB"
\ No newline at end of file
+    mysql_engine = "InnoDB"
+
+    __table_args__ = (
+        UniqueConstraint("post_id", "account_id", name="uq_liked_post_id_account_id"),  # 한 사용자는 게시물당 한 번만 좋아요
+    )
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import VARCHAR, Column, Integer, text, ForeignKey, Null
+from sqlalchemy import CHAR, VARCHAR, Column, Integer, text, ForeignKey, Null, Index
 from sqlalchemy.dialects.mysql import TINYINT
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import TIMESTAMP
@@ -10,6 +10,9 @@ class Photo(Base):
     __tablename__ = "photo"
     photo_id = Column(Integer, nullable=False, autoincrement=True, primary_key=True)
     url = Column(VARCHAR(2000), nullable=False)
+    thumbnail_url = Column(VARCHAR(2000), nullable=True, comment="긴 변 200px 변형, 만들지 못했으면 NULL")
+    medium_url = Column(VARCHAR(2000), nullable=True, comment="긴 변 800px 변형, 만들지 못했으면 NULL")
+    sha256 = Column(CHAR(64), nullable=True, comment="photo_blob 의 key, NULL 이면 참조 수를 세지 않는 사진")
     post_id = Column(Integer, ForeignKey("post.post_id"), nullable=False)
     post = relationship("Post", backref="photos")
     category_id = Column(Integer, ForeignKey("category.category_id"), default=Null)
@@ -18,12 +21,33 @@ class Photo(Base):
     create_time = Column(TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP"))
     mysql_engine = "InnoDB"
 
+    __table_args__ = (
+        Index("ix_photo_create_time_photo_id", "create_time", "photo_id"),  # cursor-list 탐색용
+    )
+
 
 class MPhoto(Base):
     __tablename__ = "m_photo"
     m_photo_id = Column(Integer, nullable=False, autoincrement=True, primary_key=True)
     url = Column(VARCHAR(2000), nullable=False)
     room_id = Column(VARCHAR(36), ForeignKey("room.room_id"), nullable=False)
+    sha256 = Column(CHAR(64), nullable=True, comment="photo_blob 의 key, NULL 이면 참조 수를 세지 않는 사진")
     account_id = Column(Integer, ForeignKey("account.account_id"), nullable=False)
     create_time = Column(TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP"))
     mysql_engine = "InnoDB"
+
+
+class PhotoBlob(Base):
+    """
+    올라온 사진 내용(SHA-256)과 S3 url 의 index, 같은 사진을 다시 올리면 새로 업로드하지 않고 이 url 을 사용
+    ref_count 는 이 blob 을 가리키는 Photo/MPhoto record 수, 0 이 되면 row 와 S3 object 를 지움
+    """
+    __tablename__ = "photo_blob"
+    folder = Column(VARCHAR(20), primary_key=True)
+    sha256 = Column(CHAR(64), primary_key=True)
+    url = Column(VARCHAR(2000), nullable=False)
+    thumbnail_url = Column(VARCHAR(2000), nullable=True)
+    medium_url = Column(VARCHAR(2000), nullable=True)
+    ref_count = Column(Integer, nullable=False, default=0)
+    create_time = Column(TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP"))
+    mysql_engine = "InnoDB"
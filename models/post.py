@@ -1,11 +1,16 @@
-from sqlalchemy import VARCHAR, Column, Integer, text, ForeignKey
-from sqlalchemy.dialects.mysql import TINYINT
-from sqlalchemy.orm import relationship
+from collections import Counter
+
+from sqlalchemy import VARCHAR, Column, Integer, text, ForeignKey, Index, event, inspect, DDL
+from sqlalchemy.dialects.mysql import TINYINT, insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import relationship, Session
 from sqlalchemy.types import TIMESTAMP
 
 from core.db import Base
 from models.account import Account
 
+HOUSE_ACCOUNT_ID = 91
+
 
 class Post(Base):
     __tablename__ = "post"
@@ -29,4 +34,109 @@ class Post(Base):
     update_time = Column(
         TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")
     )
-    mysql_engine = "InnoDB"
\ No newline at end of file
+    mysql_engine = "InnoDB"
+
+    __table_args__ = (
+        Index("ix_post_create_time_post_id", "create_time", "post_id"),  # app-paging cursor 탐색용
+    )
+
+
+# 한국어 검색을 위해 ngram parser 를 사용하는 FULLTEXT index, MySQL 에서만 생성 (SQLite 등은 CRUD 에서 python 검색으로 대체)
+# 이미 있는 테이블에는 아래 DDL 을 직접 실행해야 함
+event.listen(
+    Post.__table__,
+    "after_create",
+    DDL("ALTER TABLE post ADD FULLTEXT INDEX ft_post_title_description (title, description) WITH PARSER ngram").execute_if(
+        callable_=lambda ddl, target, bind, **kw: bind.dialect.name == "mysql" and not bind.dialect.is_mariadb
+    ),
+)
+
+
+class PostCounter(Base):
+    __tablename__ = "post_counter"
+    # PARTITION 은 MySQL 예약어라서 column 이름으로 쓰지 않음
+    partition_key = Column(VARCHAR(50), primary_key=True, comment="feed: 일반 feed, house: house feed, house:{category_id}: 카테고리별 house feed")
+    row_count = Column(Integer, nullable=False, default=0)
+    # scripts/reconcile_post_counters 가 실제 게시물 수로 맞춘 시간, NULL 이면 쓰기 쪽 증감만 쌓인 row 라서 읽을 때 사용하지 않음
+    reconcile_time = Column(TIMESTAMP, nullable=True, default=None)
+    update_time = Column(
+        TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")
+    )
+    mysql_engine = "InnoDB"
+
+
+def feed_partitions(use_locker, account_id, category_id):
+    """
+    게시물이 속하는 feed partition 목록, app_paging_record 등의 filter 조건과 같아야 함
+    """
+    if use_locker is None or use_locker == 1:
+        return []
+    if account_id == HOUSE_ACCOUNT_ID:
+        return ["house", f"house:{category_id}"]
+    return ["feed"]
+
+
+PARTITION_FIELDS = ("use_locker", "account_id", "category_id")
+
+
+def _previous_partitions(post: Post):
+    values = []
+    for field in PARTITION_FIELDS:
+        history = inspect(post).attrs[field].history
+        if history.deleted:
+            values.append(history.deleted[0])
+        elif history.unchanged:
+            values.append(history.unchanged[0])
+        else:
+            values.append(getattr(post, field))
+    return feed_partitions(*values)
+
+
+def _current_partitions(post: Post):
+    return feed_partitions(*[getattr(post, field) for field in PARTITION_FIELDS])
+
+
+def add_to_counter(connection, partition: str, delta: int):
+    """
+    partition 의 게시물 수에 delta 를 더함, counter row 가 없으면 delta 로 만듦
+    이렇게 만든 row 는 reconcile_time 이 NULL 이라서 scripts/reconcile_post_counters 로 맞추기 전까지 CRUD.partition_count 가 사용하지 않음
+    """
+    counter = PostCounter.__table__
+    row = {"partition_key": partition, "row_count": delta}
+    if connection.dialect.name in ("mysql", "mariadb"):
+        stmt = mysql_insert(counter).values(row)
+        stmt = stmt.on_duplicate_key_update(row_count=counter.c.row_count + stmt.inserted.row_count)
+    else:
+        stmt = sqlite_insert(counter).values(row)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["partition_key"], set_={"row_count": counter.c.row_count + stmt.excluded.row_count}
+        )
+    connection.execute(stmt)
+
+
+# partition 이 바뀌는 값을 덮어쓸 때 만료된 객체라도 이전 값을 불러오도록 함
+for _field in PARTITION_FIELDS:
+    event.listen(getattr(Post, _field), "set", lambda target, value, oldvalue, initiator: value,
+                 active_history=True, retval=True)
+
+
+@event.listens_for(Session, "after_flush")
+def count_feed_partitions(session, flush_context):
+    """
+    게시물 생성, 삭제, 수정이 flush 될 때 같은 transaction 안에서 partition 별 게시물 수를 갱신
+    """
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Post):
+            deltas.update(_current_partitions(obj))
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            deltas.subtract(_previous_partitions(obj))
+    for obj in session.dirty:
+        if isinstance(obj, Post) and obj not in session.deleted:
+            deltas.subtract(_previous_partitions(obj))
+            deltas.update(_current_partitions(obj))
+
+    for partition, delta in deltas.items():
+        if delta:
+            add_to_counter(session.connection(), partition, delta)
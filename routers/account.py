@@ -9,14 +9,15 @@ from starlette.status import HTTP_204_NO_CONTENT, HTTP_200_OK
 from typing_extensions import Annotated
 from passlib.context import CryptContext
 
-from core.schema import RequestPage
-from core.utils import get_crud
+from core.schema import RequestPage, RequestCursor, SEARCH_LIMIT, PAGE_LIST_DEPRECATED, cursor_list_description, search_description
+from core.filters import INT_OPS, STR_OPS
+from core.utils import get_crud, get_uow_crud
 from models.account import Account, Blame
 from models.post import Post
 from models.chat import Room
-from schemas import account
+from schemas import account, photo
 
-from typing import List, Union
+from typing import List, Union, Optional
 from os import environ
 from datetime import timedelta, datetime
 
@@ -88,6 +89,10 @@ Account table CRUD
 """
 last_request_time = {}
 
+SEARCH_FIELDS = {
+    "account_id": INT_OPS, "username": STR_OPS, "email": STR_OPS, "profile_url": STR_OPS, "available": INT_OPS,
+}
+
 
 @router.post("/mail_send",
              name="Gist mail 인증 메일 발송",
@@ -270,6 +275,8 @@ def get_current_user(token: str = Depends(oauth2_scheme),
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         account_id: str = payload.get("sub")
+        if not isinstance(payload.get("exp"), (int, float)):
+            raise credentials_exception
         if datetime.fromtimestamp(payload.get("exp")) < datetime.utcnow():
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -502,12 +509,31 @@ async def update_post_sub(file: UploadFile = File(...), current_use: Account = D
     return crud.patch_record(db_record, temp)
 
 
+@router.post(
+    "/set_user_profile_photo/confirm",
+    name="presigned 업로드한 profile photo 설정",
+    description="/photo/presign 으로 받은 url 에 profile 폴더로 올린 사진을 프로필 이미지로 설정합니다. 토큰과 함께 key 를 전송하면 됩니다.",
+    response_model=account.ReadAccount,
+    response_model_exclude={"create_time", "update_time", "available", "jail_until"},
+)
+async def confirm_profile_photo(req: photo.ConfirmPhoto, current_use: Account = Depends(get_current_user), crud=Depends(get_crud)):
+    filter = {"account_id": current_use.account_id}
+    db_record = crud.get_record(Account, filter)
+    if db_record is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    from routers.photo import confirm_uploads
+    url = (await confirm_uploads([req.key], "profile", current_use.account_id))[0]
+    temp = account.PhotoAccount(profile_url=url)
+    return crud.patch_record(db_record, temp)
+
+
 @router.post(
     "/page-list",
     name="Account 리스트 조회",
     description="Account 테이블의 페이지별 Record list 가져오는 API입니다.\
                 Page는 0이 아닌 양수로 입력해야합니다\
-                Size는 100개로 제한됩니다.",
+                Size는 100개로 제한됩니다." + PAGE_LIST_DEPRECATED,
+    deprecated=True,
 )
 async def page_account(req: RequestPage, crud=Depends(get_crud)):
     if req.page <= 0:
@@ -519,26 +545,44 @@ async def page_account(req: RequestPage, crud=Depends(get_crud)):
     return crud.paging_record(Account, req)
 
 
+@router.post(
+    "/cursor-list",
+    name="Account cursor 리스트 조회",
+    description=cursor_list_description("Account"),
+    response_model=account.CursorAccount,
+)
+async def cursor_account(req: RequestCursor, crud=Depends(get_crud)):
+    if req.size > 100:
+        raise HTTPException(status_code=400, detail="Size should be below 100")
+    if req.size <= 0:
+        raise HTTPException(status_code=400, detail="Size should be positive")
+    try:
+        return crud.cursor_paging_record(Account, req)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.post(
     "/search",
     name="Account 테이블에서 입력한 조건들에 부합하는 record 를 반환하는 API",
-    description="body에 원하는 조건들을 입력하면 and로 필터 결과 리스트를 반환합니다.\n\n"
-                "조건값이 str 일 경우 그 문자열을 포함하는 모든 record를 반환합니다.\n\n"
-                "조건값이 int,float 일 경우 그 값과 동일한 record만 반환합니다.\n\n"
-                "조건값이 list 경우 list 항목을 포함하는 모든 record를 반환합니다.\n\n"
-                "dict로 검색가능 필드는 account_id(int), username(str), email(str), profile_url(str), available(int) 입니다."
-                "\n\n모든 필드에 값을 넣어서 검색하지 않아도 됩니다. 원하는 필드만 사용하여서 검색이 가능합니다.",
+    description=search_description(SEARCH_FIELDS),
     response_model=List[account.ReadAccount],
     response_model_exclude={"create_time", "update_time", "available", "jail_until"}
 )
-async def search_account(filters: dict = Body(..., examples=[{
+async def search_account(response: Response, filters: dict = Body(..., examples=[{
     "account_id": 1,
     "username": "jaesun",
     "email": "rejaealsun",
     "profile_url": "https:// my_profile_url",
     "available": 1
-  }]), crud=Depends(get_crud)):
-    return crud.search_record(Account, filters)
+  }]), limit: int = SEARCH_LIMIT, cursor: Optional[str] = None, crud=Depends(get_crud)):
+    try:
+        page = crud.filter_record(Account, filters, SEARCH_FIELDS, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["items"]
 
 
 @router.get(
@@ -593,9 +637,11 @@ def get_list(crud=Depends(get_crud)):
     name="Account record 삭제",
     description="입력된 id에 해당하는 Account record를 삭제합니다.",
 )
-async def delete_account(current_user: Account=Depends(get_current_user), crud=Depends(get_crud)):
+async def delete_account(current_user: Account=Depends(get_current_user), crud=Depends(get_uow_crud)):
     filter = {"account_id": current_user.account_id}
     record = crud.get_record(Account, filter)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Record not found")
     posts = crud.search_record(Post, filter)
     for post in posts:
         crud.patch_record(post, {"status": 3, "username": "알 수 없는 사용자"})
@@ -612,6 +658,5 @@ async def delete_account(current_user: Account=Depends(get_current_user), crud=D
             crud.patch_record(r, {"status": -1})
         else:
             crud.patch_record(r, {"status": current_user.account_id})
-    if record is None:
-        raise HTTPException(status_code=404, detail="Record not found")
+    crud.commit()
     return Response(status_code=HTTP_204_NO_CONTENT)
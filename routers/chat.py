@@ -1,17 +1,25 @@
-import ast
+import asyncio
+import hmac
+from functools import partial
+from os import environ
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, UploadFile, WebSocket, WebSocketDisconnect, status
+from sqlalchemy import and_, case, func, or_, select
 
-from core.utils import get_crud
+from core.broker import broker, room_channel
+from core.utils import get_crud, get_uow_crud
 from models.chat import *
 from schemas import chat, photo
 from routers.account import get_current_user
-from routers.photo import upload_file
+from routers.photo import upload_photos, confirm_photos, attach_blobs
 from models.account import Account
 from models.photo import MPhoto
 from models.post import Post
 
-from typing import List
+from typing import List, Optional
+
+import sentry_sdk
+
 
 router = APIRouter(
     prefix="/chat",
@@ -22,6 +30,96 @@ Chat table CRUD
 """
 
 
+def to_record_chat(message: Message, room: Room, watermarks: dict) -> chat.RecordChat:
+    """
+    응답용 RecordChat 으로 변환, 사진 메시지는 url 리스트를 content 로 내보냄
+    read 는 받는 사람의 last_read_message_id 까지 읽었는지로 계산 (예전 메시지는 저장된 read 값도 인정)
+    ORM 객체의 content 를 직접 바꾸지 않아서 commit 때 잘못 저장되지 않음
+    """
+    record = chat.RecordChat.from_orm(message)
+    record.content = message.payload()
+    receiver_id = room.seller_id if message.is_from_buyer else room.buyer_id
+    record.read = 1 if message.read or message.message_id <= watermarks.get(receiver_id, 0) else 0
+    return record
+
+
+def get_messages(crud, room_id: str, size: Optional[int] = None, before: Optional[int] = None, after: Optional[int] = None) -> list:
+    """
+    채팅방 메시지를 message_id 오름차순으로 size 개(None 이면 전부) 가져옴, seek_record 와 같은 before/after 규칙
+    보관된(message_archive) 메시지는 항상 message 에 남은 메시지보다 이전이므로 한쪽에서 부족한 만큼 다른 쪽에서 이어서 읽음
+    """
+    cond = {"room_id": room_id}
+    if after is not None:
+        archived = crud.seek_record(MessageArchive, cond, size, after=after)
+        if size is not None and len(archived) >= size:
+            return archived
+        rest = None if size is None else size - len(archived)
+        return archived + crud.seek_record(Message, cond, rest, after=archived[-1].message_id if archived else after)
+    messages = crud.seek_record(Message, cond, size, before=before)
+    if size is not None and len(messages) >= size:
+        return messages
+    rest = None if size is None else size - len(messages)
+    return crud.seek_record(MessageArchive, cond, rest, before=messages[0].message_id if messages else before) + messages
+
+
+def get_last_messages(crud, rooms: List[str]) -> dict:
+    """
+    채팅방별 마지막 메시지를 {room_id: message} 로 반환, message 에 메시지가 없는 방만 보관된 메시지에서 찾음
+    """
+    last_messages = crud.latest_per_group(Message, "room_id", rooms)
+    archived_rooms = [room for room in rooms if room not in last_messages]
+    if archived_rooms:
+        last_messages.update(crud.latest_per_group(MessageArchive, "room_id", archived_rooms))
+    return last_messages
+
+
+def get_my_room(crud, room_id: str, account_id: int) -> Room:
+    """
+    account_id 가 구매자나 판매자로 참여한 채팅방, 없으면 404, 참여자가 아니면 401
+    """
+    room_info: Room = crud.get_record(Room, {"room_id": room_id})
+    if room_info is None:
+        raise HTTPException(status_code=404, detail="Record not found room")
+    if account_id not in (room_info.buyer_id, room_info.seller_id):
+        raise HTTPException(status_code=401, detail="Unauthorized request")
+    return room_info
+
+
+def get_watermarks(crud, room_id: str) -> dict:
+    """
+    채팅방 참여자별 last_read_message_id 를 {account_id: message_id} 로 반환
+    """
+    return {s.account_id: s.last_read_message_id for s in crud.search_record(RoomReadState, {"room_id": room_id})}
+
+
+def mark_read(crud, room_id: str, account_id: int, messages: List[Message], watermarks: dict):
+    """
+    가져온 메시지 중 가장 큰 message_id 까지 읽음 처리, message row 는 수정하지 않고 room_read_state 한 줄만 upsert
+    """
+    if not messages:
+        return
+    last_id = max(m.message_id for m in messages)
+    crud.upsert_max(RoomReadState, {"room_id": room_id, "account_id": account_id}, "last_read_message_id", last_id)
+    watermarks[account_id] = max(last_id, watermarks.get(account_id, 0))
+
+
+def get_room_details(crud, rooms: List[str], account_id: int) -> dict:
+    """
+    room 과 게시물, 상대방 계정 정보를 room JOIN post JOIN account 한 번의 query 로 가져와서 {room_id: row} 로 반환
+    상대방은 내가 구매자면 판매자, 아니면 구매자
+    """
+    opponent_id = case((Room.buyer_id == account_id, Room.seller_id), else_=Room.buyer_id)
+    rows = crud.join_record(
+        Room,
+        [(Post, Post.post_id == Room.post_id), (Account, Account.account_id == opponent_id)],
+        "room_id", rooms,
+        Room.room_id, Room.post_id, Room.buyer_id,
+        Post.post_id.label("post_exists"), Post.representative_photo_id,
+        Account.account_id.label("opponent_exists"), Account.username, Account.profile_url,
+    )
+    return {row.room_id: row for row in rows}
+
+
 @router.post(
     "/photo_chat", name="사진 보내기 전용 채팅", description="Message 테이블에 사진 함께 Record를 생성합니다\n\n"
                                                                  "들어갈 변수들은 쿼리(query)"
@@ -29,19 +127,26 @@ Chat table CRUD
                                                                  "Request Body에 사진 파일들을 담으면 됩니다.",
     response_model=chat.PhotoChat
 )
-async def create_with_photo(files: List[UploadFile], req: photo.MPhotoStart = Depends(), crud=Depends(get_crud), current_user: Account = Depends(get_current_user)):
-    urls = []
-    for idx, file in enumerate(files):
-        url = await upload_file(file, "message")
-        temp_photo = photo.MPhotoUpload(
-            url=url,
-            room_id=req.room_id,
-            account_id=current_user.account_id
-        )
-        crud.create_record(MPhoto, temp_photo)
-        urls.append(url)
+async def create_with_photo(files: List[UploadFile], req: photo.MPhotoStart = Depends(), crud=Depends(get_uow_crud), current_user: Account = Depends(get_current_user)):
+    uploaded = attach_blobs(crud, "message", await upload_photos(crud, files, "message"))
+    photos = [photo.MPhotoUpload(**urls, room_id=req.room_id, account_id=current_user.account_id) for urls in uploaded]
+    crud.create_many(MPhoto, photos)
+    crud.commit()
+    return chat.PhotoChat(content=[urls["url"] for urls in uploaded])
+
 
-    return chat.PhotoChat(content=urls)
+@router.post(
+    "/photo_chat/confirm", name="presigned 업로드한 사진 채팅 기록",
+    description="/photo/presign 으로 받은 url 에 message 폴더로 올린 사진들을 MPhoto 테이블에 기록합니다.\n\n"
+                "응답은 /photo_chat 과 같이 keys 순서대로의 사진 url 목록입니다.",
+    response_model=chat.PhotoChat
+)
+async def confirm_photo_chat(req: photo.ConfirmMPhotos, crud=Depends(get_uow_crud), current_user: Account = Depends(get_current_user)):
+    uploaded = attach_blobs(crud, "message", await confirm_photos(crud, req.keys, "message", current_user.account_id))
+    photos = [photo.MPhotoUpload(**urls, room_id=req.room_id, account_id=current_user.account_id) for urls in uploaded]
+    crud.create_many(MPhoto, photos)
+    crud.commit()
+    return chat.PhotoChat(content=[urls["url"] for urls in uploaded])
 
 
 @router.post(
@@ -63,45 +168,44 @@ async def get_chatroom(req: chat.RoomNumber, crud=Depends(get_crud), current_use
     "/unread/{room_id}",
     name="채팅방에서 안읽은 메시지만 가져오기 + 읽음 처리",
     description="한 채팅방의 않읽은 메시지를 가져옵니다\n\n"
-                "가져옴과 동시에 읽음처리가 진행됩니다.",
+                "가져옴과 동시에 읽음처리가 진행됩니다. 읽은 위치는 사용자별로 저장되므로 헤더에 JWT 토큰을 같이 보내야 합니다.",
     response_model=List[chat.RecordChat],
 )
-async def get_unread_list(room_id: str, crud=Depends(get_crud)):
-    messages = crud.search_record(Message, {"room_id": room_id, "read": 0})
-    for idx, m in enumerate(messages):
-        if m.read == 0:
-            crud_generator = get_crud()
-            crud = next(crud_generator)
-            crud.patch_record(m, {"read": 1})  # 읽음 처리
-            messages[idx].read = 1
-        if m.is_photo:
-            if m.content == "img":
-                continue
-            messages[idx].content = ast.literal_eval(m.content)
-    return messages
+async def get_unread_list(room_id: str, current_user: Account = Depends(get_current_user), crud=Depends(get_uow_crud)):
+    room_info = get_my_room(crud, room_id, current_user.account_id)
+    watermarks = get_watermarks(crud, room_id)
+    last_read = watermarks.get(current_user.account_id)
+    if last_read is None:
+        # 아직 읽은 위치가 없는 방은 예전 read 값으로 판단
+        cond = {"room_id": room_id, "read": 0}
+        messages = crud.search_record(MessageArchive, cond) + crud.search_record(Message, cond)
+    else:
+        messages = get_messages(crud, room_id, after=last_read)
+    # 가져온 메시지까지만 읽음 처리, 그 사이에 새로 온 메시지는 다음 조회에서 가져감
+    mark_read(crud, room_id, current_user.account_id, messages, watermarks)
+    crud.commit()
+    return [to_record_chat(m, room_info, watermarks) for m in messages]
 
 @router.get(
     "/all/{room_id}",
     name="채팅방에서 모든 메시지 가져오기",
     description="한 채팅방의 모든 메시지를 가져옵니다.\n\n"
                 "가져옴과 동시에 사용자 입장에서의 읽음처리가 진행됩니다. "
-                "추가로 JWT를 헤더에 같이 입력해주어야 합니다.",
+                "추가로 JWT를 헤더에 같이 입력해주어야 합니다.\n\n"
+                "size를 주면 가장 최근 메시지 size개만 가져옵니다. 더 이전 메시지는 받은 목록의 가장 작은 message_id를 "
+                "before_message_id로, 이후에 온 새 메시지는 가장 큰 message_id를 after_message_id로 보내서 이어서 가져옵니다. "
+                "어느 경우든 message_id 오름차순으로 반환합니다.\n\n"
+                "size를 주지 않으면 기존처럼 전체 메시지를 가져옵니다.",
     response_model=List[chat.RecordChat],
 )
-async def get_all_list(room_id: str, current_user: Account = Depends(get_current_user), crud=Depends(get_crud)):
-    room_info: Room = crud.get_record(Room, {"room_id": room_id})
-    if room_info.buyer_id == current_user.account_id:
-        messages = crud.search_record(Message, {"room_id": room_id, "is_from_buyer": 1})
-    else:
-        messages = crud.search_record(Message, {"room_id": room_id, "is_from_buyer": 0})
-    crud.patch_all(messages, {"read": 1})
-    all_messages = crud.search_record(Message, {"room_id": room_id})
-    for idx, m in enumerate(all_messages):
-        if m.is_photo:
-            if m.content == "img":
-                continue
-            all_messages[idx].content = ast.literal_eval(m.content)
-    return all_messages
+async def get_all_list(room_id: str, size: Optional[int] = Query(None, ge=1, le=200), before_message_id: Optional[int] = None,
+                       after_message_id: Optional[int] = None, current_user: Account = Depends(get_current_user), crud=Depends(get_uow_crud)):
+    room_info = get_my_room(crud, room_id, current_user.account_id)
+    all_messages = get_messages(crud, room_id, size, before_message_id, after_message_id)
+    watermarks = get_watermarks(crud, room_id)
+    mark_read(crud, room_id, current_user.account_id, all_messages, watermarks)
+    crud.commit()
+    return [to_record_chat(m, room_info, watermarks) for m in all_messages]
 
 
 @router.post(
@@ -115,8 +219,9 @@ async def read_post(req: chat.OppoRoom, current_user: Account = Depends(get_curr
     ids = []
     iams = []
     repr_photos = []
+    details = get_room_details(crud, req.rooms, current_user.account_id)
     for room in req.rooms:
-        temp: Room = crud.get_record(Room, {"room_id": room})
+        temp = details.get(room)
         if temp is None:
             raise HTTPException(status_code=404, detail="Record not found room")
         if temp.buyer_id == current_user.account_id:
@@ -125,11 +230,10 @@ async def read_post(req: chat.OppoRoom, current_user: Account = Depends(get_curr
             iams.append(False)
         ids.append(temp.post_id)
 
-        temp_post: Post = crud.get_record(Post, {"post_id": temp.post_id})
-        if temp_post is None:
+        if temp.post_exists is None:
             raise HTTPException(status_code=404, detail="Record not found on post")
-        if temp_post.representative_photo_id:
-            repr_photos.append(temp_post.representative_photo_id)
+        if temp.representative_photo_id:
+            repr_photos.append(temp.representative_photo_id)
         else:
             repr_photos.append(0)
 
@@ -146,22 +250,18 @@ async def read_post(req: chat.OppoRoom, current_user: Account = Depends(get_curr
 async def get_opponents_name(req: chat.OppoRoom, current_user: Account = Depends(get_current_user), crud=Depends(get_crud)):
     res = []
     profiles = []
+    details = get_room_details(crud, req.rooms, current_user.account_id)
     for room in req.rooms:
-        temp: Room = crud.get_record(Room, {"room_id": room})
-        if current_user.account_id == temp.buyer_id:
-            seller = crud.get_record(Account, {"account_id": temp.seller_id})
-            res.append(seller.username)
-            if seller.profile_url:
-                profiles.append(seller.profile_url)
-            else:
-                profiles.append(None)
+        temp = details.get(room)
+        if temp is None:
+            raise HTTPException(status_code=404, detail="Record not found room")
+        if temp.opponent_exists is None:
+            raise HTTPException(status_code=404, detail="Record not found on account")
+        res.append(temp.username)
+        if temp.profile_url:
+            profiles.append(temp.profile_url)
         else:
-            buyer = crud.get_record(Account, {"account_id": temp.buyer_id})
-            res.append(buyer.username)
-            if buyer.profile_url:
-                profiles.append(buyer.profile_url)
-            else:
-                profiles.append(None)
+            profiles.append(None)
 
     return chat.OppoName(usernames=res, profiles=profiles)
 
@@ -179,36 +279,31 @@ async def get_room_status(req: chat.OppoRoom, current_user: Account = Depends(ge
     times = []
     counts = []
 
+    # 방 목록, 방별 마지막 메시지, 방별/보낸 쪽별 안읽은 메시지 수를 각각 한 번의 query 로 가져옴
+    # 안읽은 메시지는 내 last_read_message_id 이후의 메시지, 읽은 위치가 없는 방은 예전 read 값으로 셈
+    rooms = {r.room_id: r for r in crud.search_in(Room, "room_id", req.rooms)}
+    last_messages = get_last_messages(crud, req.rooms)
+    unread_counts = crud.count_after(
+        Message, ["room_id", "is_from_buyer"], "room_id", req.rooms,
+        RoomReadState.last_read_message_id, {"account_id": current_user.account_id}, Message.read == 0
+    )
+
     for room in req.rooms:
-        count = 0
-        last: Message = crud.search_record(Message, {"room_id": room})
+        info: Room = rooms.get(room)
+        if info is None:
+            raise HTTPException(status_code=404, detail="Record not found room")
+
+        last: Message = last_messages.get(room)
         if last:
-            if last[-1].is_photo:
-                lasts.append(ast.literal_eval(last[-1].content))
-            else:
-                lasts.append(last[-1].content)
-            times.append(last[-1].create_time)
+            lasts.append(last.payload())
+            times.append(last.create_time)
         else:
             lasts.append(None)
             times.append(None)
 
-        unread: List[Message] = crud.search_record(Message, {"room_id": room, "read": 0})
-        info: Room = crud.get_record(Room, {"room_id": room})
-
-        if info.buyer_id == current_user.account_id:
-            from_buyer = True
-        else:
-            from_buyer = False
-
-        if unread:
-            if unread[0].is_from_buyer:
-                if not from_buyer:
-                    count += len(unread)
-            else:
-                if from_buyer:
-                    count += len(unread)
-
-        counts.append(count)
+        # 상대방이 보낸 메시지 중 안읽은 것만 셈
+        from_buyer = info.buyer_id == current_user.account_id
+        counts.append(unread_counts.get((room, 0 if from_buyer else 1), 0))
 
     return chat.RoomStatus(last_messages=lasts, update_times=times, counts=counts)
 
@@ -221,18 +316,220 @@ async def get_room_status(req: chat.OppoRoom, current_user: Account = Depends(ge
     response_model=chat.RoomIDs
 )
 async def get_my_room_ids(current_user: Account = Depends(get_current_user), crud=Depends(get_crud)):
+    return chat.RoomIDs(room_ids=get_visible_room_ids(crud, current_user.account_id))
+
+
+def get_visible_room_ids(crud, account_id: int) -> List[str]:
+    """
+    판매자나 구매자로 속해 있고 나간 처리되지 않은 채팅방의 UUID 리스트
+    """
     res = []
-    rooms_sell = crud.search_record(Room, {"seller_id": current_user.account_id})
-    rooms_buy = crud.search_record(Room, {"buyer_id": current_user.account_id})
+    rooms_sell = crud.search_record(Room, {"seller_id": account_id})
+    rooms_buy = crud.search_record(Room, {"buyer_id": account_id})
 
     for r1 in rooms_sell:
-        if r1.status == current_user.account_id or r1.status == -1:
+        if r1.status == account_id or r1.status == -1:
             continue
         res.append(r1.room_id)
     for r2 in rooms_buy:
-        if r2.status == current_user.account_id or r2.status == -1:
+        if r2.status == account_id or r2.status == -1:
             continue
         res.append(r2.room_id)
 
-    return chat.RoomIDs(room_ids=res)
+    return res
+
+
 
+@router.get(
+    "/inbox",
+    name="채팅 목록 한 번에 가져오기",
+    description="Header에 JWT 토큰을 담아서 보내면, 자신이 속해있는 채팅방 목록을 최근 메시지 순으로 가져옵니다.\n\n"
+                "my_rooms, room_info, my_opponents, my_room_status 를 차례로 호출하던 것을 한 번의 요청으로 대신합니다. "
+                "각 채팅방마다 room_id, post_id, 내가 구매자인지(iam_buyer), 게시물 대표 사진(repr_photo_id), 상대방 닉네임과 프로필, "
+                "마지막 메시지와 시간, 안읽은 메시지 수를 반환합니다.\n\n"
+                "size개씩 가져오며, 다음 목록은 응답의 next_cursor를 cursor로 보내면 이어서 가져옵니다. next_cursor가 null이면 마지막입니다. "
+                "Size는 100개로 제한됩니다.\n\n"
+                "나간 처리된 채팅방은 불러 오지 않습니다.",
+    response_model=chat.Inbox
+)
+async def get_inbox(size: int = 20, cursor: Optional[str] = None, current_user: Account = Depends(get_current_user), crud=Depends(get_crud)):
+    if size > 100:
+        raise HTTPException(status_code=400, detail="Size should be below 100")
+    if size <= 0:
+        raise HTTPException(status_code=400, detail="Size should be positive")
+    me = current_user.account_id
+
+    # 1. 방, 게시물, 상대방 정보를 마지막 메시지 순으로 한 번에 조회 (메시지가 없는 방은 마지막)
+    # message 에 메시지가 없는 방은 보관된 메시지의 마지막 id 를 사용
+    last_ids = [
+        select(func.max(table.message_id)).where(table.room_id == Room.room_id).correlate(Room).scalar_subquery()
+        for table in (Message, MessageArchive)
+    ]
+    last_id = func.coalesce(*last_ids)
+    opponent_id = case((Room.buyer_id == me, Room.seller_id), else_=Room.buyer_id)
+    try:
+        page = crud.join_seek_record(
+            Room,
+            [(Post, Post.post_id == Room.post_id), (Account, Account.account_id == opponent_id)],
+            [
+                or_(Room.seller_id == me, Room.buyer_id == me),
+                or_(Room.status.is_(None), and_(Room.status != me, Room.status != -1)),
+            ],
+            [func.coalesce(last_id, 0), Room.room_id],
+            size, cursor,
+            Room.room_id, Room.post_id, Room.buyer_id, Post.representative_photo_id,
+            Account.username, Account.profile_url, last_id.label("last_message_id"),
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    rows = page["items"]
+    room_ids = [row.room_id for row in rows]
+
+    # 2. 마지막 메시지, 3. 안읽은 메시지 수
+    last_ids = [row.last_message_id for row in rows if row.last_message_id]
+    last_messages = {m.message_id: m for m in crud.search_in(Message, "message_id", last_ids)}
+    archived_ids = [message_id for message_id in last_ids if message_id not in last_messages]
+    if archived_ids:
+        last_messages.update({m.message_id: m for m in crud.search_in(MessageArchive, "message_id", archived_ids)})
+    unread_counts = crud.count_after(
+        Message, ["room_id", "is_from_buyer"], "room_id", room_ids,
+        RoomReadState.last_read_message_id, {"account_id": me}, Message.read == 0
+    )
+
+    items = []
+    for row in rows:
+        iam_buyer = row.buyer_id == me
+        last: Message = last_messages.get(row.last_message_id)
+        items.append(chat.InboxRoom(
+            room_id=row.room_id,
+            post_id=row.post_id,
+            iam_buyer=iam_buyer,
+            repr_photo_id=row.representative_photo_id or 0,
+            username=row.username,
+            profile_url=row.profile_url,
+            last_message=last.payload() if last else None,
+            update_time=last.create_time if last else None,
+            count=unread_counts.get((row.room_id, 0 if iam_buyer else 1), 0),
+        ))
+    return chat.Inbox(items=items, next_cursor=page["next_cursor"])
+
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket, token: Optional[str] = None):
+    """
+    새 메시지를 받는 WebSocket, 토큰은 Authorization 헤더(Bearer)나 token 쿼리로 보냄
+    접속하면 속해 있는 채팅방들을 구독하고, 저장된 새 메시지를 RecordChat 형식에 room_id 를 더해서 보냄
+    접속 뒤에 생긴 채팅방은 {"subscribe": room_id} 를 보내서 추가로 구독
+    """
+    if token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        token = credentials if scheme.lower() == "bearer" else None
+    if not token:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # 인증과 방 목록 조회에만 DB session 을 쓰고, 연결이 유지되는 동안에는 session 을 잡고 있지 않음
+    crud_generator = get_crud()
+    crud = next(crud_generator)
+    try:
+        current_user: Account = get_current_user(token, crud)
+        account_id = current_user.account_id
+        room_ids = get_visible_room_ids(crud, account_id)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    finally:
+        crud_generator.close()
+
+    await websocket.accept()
+    subscription = broker.subscribe(room_channel(room_id) for room_id in room_ids)
+
+    async def forward():
+        async for payload in subscription:
+            await websocket.send_json(payload)
+
+    sender = asyncio.create_task(forward())
+    try:
+        while True:
+            request = await websocket.receive_json()
+            room_id = request.get("subscribe") if isinstance(request, dict) else None
+            if room_id is None:
+                continue
+            crud_generator = get_crud()
+            crud = next(crud_generator)
+            try:
+                room_info: Room = crud.get_record(Room, {"room_id": room_id})
+            finally:
+                crud_generator.close()
+            if room_info is not None and account_id in (room_info.buyer_id, room_info.seller_id):
+                subscription.add(room_channel(room_id))
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        sender.cancel()
+        subscription.close()
+        try:
+            await sender
+        except (asyncio.CancelledError, WebSocketDisconnect):
+            pass
+        except Exception:
+            # broker 나 전송 중 난 오류를 버리지 않고 sentry 로 보냄
+            sentry_sdk.capture_exception()
+
+
+RELAY_API_KEY = environ.get("RELAY_API_KEY")
+BULK_MESSAGE_LIMIT = 500
+
+
+def verify_relay(x_relay_key: Optional[str] = Header(None)):
+    """
+    socket relay 서버만 호출할 수 있는 API 의 인증, X-Relay-Key 헤더가 RELAY_API_KEY 와 같아야 함
+    """
+    if not RELAY_API_KEY:
+        raise HTTPException(status_code=503, detail="Relay API is not configured")
+    if x_relay_key is None or not hmac.compare_digest(x_relay_key, RELAY_API_KEY):
+        raise HTTPException(status_code=401, detail="Unauthorized request")
+
+
+@router.post(
+    "/messages/bulk",
+    name="여러 메시지 한 번에 저장",
+    description="socket relay 서버가 받은 메시지들을 한 번에 저장합니다. 여러 채팅방의 메시지를 섞어서 보낼 수 있습니다.\n\n"
+                f"한 번에 최대 {BULK_MESSAGE_LIMIT}개까지 보낼 수 있고, 헤더의 X-Relay-Key 가 서버에 설정된 키와 같아야 합니다.\n\n"
+                "사진 메시지는 content에 url 리스트를 담으면 됩니다. 메시지들은 하나의 transaction 안에서 저장되고 "
+                "(DB 설정에 따라 한 번의 multi-row INSERT 또는 메시지별 INSERT) 각 채팅방의 마지막 활동 시간도 같은 transaction 안에서 갱신됩니다.\n\n"
+                "입력한 순서대로 저장된 message_id 리스트를 반환하고, 저장된 메시지는 WebSocket 구독자에게 전달됩니다.",
+    response_model=chat.MessageIDs,
+    dependencies=[Depends(verify_relay)],
+)
+async def create_messages(req: List[chat.Message], crud=Depends(get_uow_crud)):
+    if not req:
+        return chat.MessageIDs(message_ids=[])
+    if len(req) > BULK_MESSAGE_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Too many messages (max {BULK_MESSAGE_LIMIT})")
+    room_ids = list({m.room_id for m in req})
+    if len(crud.search_in(Room, "room_id", room_ids)) != len(room_ids):
+        raise HTTPException(status_code=404, detail="Record not found room")
+
+    rows = []
+    for m in req:
+        # 사진 url 리스트는 photo_urls 에 저장하고, content 는 예전 형식(리스트 문자열)을 유지
+        urls = m.content if isinstance(m.content, list) else None
+        rows.append({
+            "room_id": m.room_id,
+            "is_from_buyer": m.is_from_buyer,
+            "is_photo": m.is_photo,
+            "content": str(urls) if urls is not None else m.content,
+            "photo_urls": urls,
+            "read": m.read,
+        })
+    message_ids = crud.create_many(Message, rows)
+    crud.update_where(Room, {}, {"update_time": func.now()}, Room.room_id.in_(room_ids))
+
+    # ORM flush 로 저장된 메시지는 after_flush hook 이 이미 전달을 예약했으므로, multi-row INSERT 로 저장된 메시지만 commit 뒤에 전달
+    published = crud.session.info.get("published_message_ids", set())
+    unpublished = [message_id for message_id in message_ids if message_id not in published]
+    for message in crud.search_in(Message, "message_id", unpublished):
+        crud.on_commit(partial(broker.publish, room_channel(message.room_id), message.to_event()))
+    crud.commit()
+    return chat.MessageIDs(message_ids=message_ids)
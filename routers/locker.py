@@ -1,16 +1,19 @@
 from datetime import datetime, timedelta
 
 from fastapi import APIRouter, Depends, HTTPException, UploadFile
+from starlette.responses import Response
 
+from core.filters import INT_OPS, STR_OPS
+from core.schema import SEARCH_LIMIT, search_description
 from core.utils import get_crud
 from models.locker import Locker, LockerAuth
 from schemas import locker
 from routers.account import get_current_user
-from routers.photo import upload_file
+from routers.photo import upload_file, confirm_uploads
 from models.account import Account
 from models.post import Post
 
-from typing import List
+from typing import List, Optional
 
 router = APIRouter(
     prefix="/locker",
@@ -20,19 +23,25 @@ router = APIRouter(
 Chat table CRUD
 """
 
+SEARCH_FIELDS = {
+    "locker_id": INT_OPS, "name": STR_OPS, "status": INT_OPS, "post_id": INT_OPS, "account_id": INT_OPS,
+}
+
 
 @router.post(
     "/search",
     name="locker 테이블에서 입력한 조건들에 부합하는 record 를 반환하는 API",
-    description="body에 원하는 조건들을 입력하면 and로 필터 결과 리스트를 반환합니다\n"
-                "조건값이 str 일 경우 그 문자열을 포함하는 모든 record를 반환합니다.\n"
-                "조건값이 int,float 일 경우 그 값과 동일한 record만 반환합니다.\n"
-                "조건값이 list 경우 list 항목을 포함하는 모든 record를 반환합니다.\n"
-                "dict형으로 locker_id(int), name(str), status(int), post_id(int), account_id(int)를 field로 받을 수 있습니다.",
+    description=search_description(SEARCH_FIELDS),
     response_model=List[locker.ReadLocker],
 )
-async def search_post(filters: dict, crud=Depends(get_crud)):
-    return crud.search_record(Locker, filters)
+async def search_post(response: Response, filters: dict, limit: int = SEARCH_LIMIT, cursor: Optional[str] = None, crud=Depends(get_crud)):
+    try:
+        page = crud.filter_record(Locker, filters, SEARCH_FIELDS, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["items"]
 
 
 @router.get(
@@ -110,6 +119,27 @@ async def post_locker_auth(file: UploadFile, req: locker.LockerAuth = Depends(),
     return crud.create_record(LockerAuth, locker.AuthUpload(post_id=req.post_id, locker_id=req.locker_id, password=req.password, photo_url=url))
 
 
+@router.post(
+    "/locker_auth/confirm",
+    name="presigned 업로드한 사진으로 사물함 배치 인증",
+    description="/photo/presign 으로 받은 url 에 auth 폴더로 올린 사진으로 사물함 배치 인증 정보를 입력합니다.\n\n"
+                "필요한 정보는 post_id, locker_id, password 와 업로드한 사진의 key 입니다.",
+    response_model=locker.AuthRead
+)
+async def confirm_locker_auth(req: locker.AuthConfirm, crud=Depends(get_crud), current_user: Account = Depends(get_current_user)):
+    user_post: Post = crud.get_record(Post, {"post_id": req.post_id})
+    if user_post is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    if user_post.account_id != current_user.account_id:
+        raise HTTPException(status_code=401, detail="Unauthorized request")
+    if datetime.now() > user_post.create_time + timedelta(minutes=15):
+        raise HTTPException(status_code=408, detail="Authentication time has expired")
+    url = (await confirm_uploads([req.key], "auth", current_user.account_id))[0]
+
+    crud.patch_record(user_post, {"use_locker": 2})
+    return crud.create_record(LockerAuth, locker.AuthUpload(post_id=req.post_id, locker_id=req.locker_id, password=req.password, photo_url=url))
+
+
 @router.get(
     "/locker_auth/{post_id}",
     name="사물함 정보, 비밀번호 전송",
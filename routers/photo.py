@@ -1,23 +1,30 @@
+import asyncio
+import hashlib
 import os
+import re
+from functools import partial
 
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import Response
 from starlette.status import HTTP_204_NO_CONTENT
 
-from core.schema import RequestPage
-from core.utils import get_crud
-from models.photo import Photo, MPhoto
+from core import images, storage
+from core.schema import RequestPage, RequestCursor, SEARCH_LIMIT, PAGE_LIST_DEPRECATED, cursor_list_description, search_description
+from core.filters import INT_OPS, STR_OPS
+from core.utils import get_crud, get_uow_crud
+from models.photo import Photo, MPhoto, PhotoBlob
 from models.post import Post
 from models.account import Account
 from routers.account import get_current_user
 from schemas import photo, post
 
-from typing import List
-from os import environ
+from typing import Dict, List, Optional
 
-import boto3
 import uuid
 
+import sentry_sdk
+
 
 router = APIRouter(
     prefix="/photo",
@@ -27,22 +34,258 @@ router = APIRouter(
 Photo table CRUD
 """
 
+SEARCH_FIELDS = {
+    "photo_id": INT_OPS, "url": STR_OPS, "post_id": INT_OPS, "category_id": INT_OPS, "account_id": INT_OPS,
+}
+M_SEARCH_FIELDS = {"m_photo_id": INT_OPS, "url": STR_OPS, "room_id": {"eq", "in"}, "account_id": INT_OPS}
+# presigned url 로 직접 올릴 수 있는 폴더
+PRESIGN_FOLDERS = {"post", "message", "profile", "auth"}
+# 변형(thumbnail, medium)을 만드는 폴더
+VARIANT_FOLDERS = {"post"}
+
+
+def check_size(file: UploadFile):
+    # 크기를 알면 읽거나 S3 에 보내기 전에 거절
+    if file.size is not None and file.size > storage.MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail=f"File is larger than {storage.MAX_UPLOAD_SIZE} bytes")
+
+
 async def upload_file(file: File(...), folder_name: str):
+    # 공유 s3 client 로 event loop 밖에서 업로드
+    check_size(file)
+    _, file_extension = os.path.splitext(file.filename)
+    random_file_name = f"{folder_name}/{str(uuid.uuid4()) + file_extension}"
+    try:
+        return await storage.upload(file.file, random_file_name)
+    except storage.FileTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except storage.UnsupportedFile as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+
+async def upload_variants(key: str, data: bytes) -> dict:
+    """
+    원본 key 옆에 thumbnail, medium 변형을 만들어 올리고 {"thumbnail_url": ..., "medium_url": ...} 반환
+    Pillow 가 열지 못하는 형식(HEIC 등)이거나 변환에 실패하면 빈 dict, 이때 클라이언트는 원본 url 을 사용
+    """
+    try:
+        variants = await images.make_variants(data)
+    except Exception:
+        sentry_sdk.capture_exception()
+        return {}
+    names = list(variants)
+    urls = await asyncio.gather(*[
+        storage.put(variants[name][0], images.variant_key(key, name), variants[name][1]) for name in names
+    ])
+    return {f"{name}_url": url for name, url in zip(names, urls)}
+
+
+def blob_urls(blob: PhotoBlob) -> dict:
+    return {"url": blob.url, "thumbnail_url": blob.thumbnail_url, "medium_url": blob.medium_url, "sha256": blob.sha256}
+
+
+async def find_blobs(crud, folder_name: str, hashes: List[str]) -> Dict[str, dict]:
+    """
+    hashes 중 이미 올라와 있는 사진들의 {sha256: blob_urls}, 업로드를 건너뛸지 정하는 읽기 전용 조회
+    요청의 crud 로 한 번에 조회하고 바로 transaction 을 끝내서, 업로드하는 동안 connection 을 잡고 있지 않음
+    참조 수는 record 를 저장할 때 attach_blobs 가 요청의 transaction 안에서 늘림
+    """
+    def lookup():
+        opened = not crud.session.in_transaction()
+        blobs = crud.search_in(PhotoBlob, "sha256", sorted(set(hashes)))
+        found = {blob.sha256: blob_urls(blob) for blob in blobs if blob.folder == folder_name}
+        if opened:
+            # 이 조회가 시작한 transaction 은 읽기만 했으므로 끝내서 connection 을 돌려줌
+            crud.session.rollback()
+        return found
+
+    return await run_in_threadpool(lookup)
+
+
+def attach_blob(crud, folder_name: str, urls: dict) -> dict:
+    """
+    upload_photo, confirm_photo 의 결과를 record 로 저장하기 전에 crud 의 transaction 안에서 blob 참조를 하나 늘리고 저장할 url 들을 반환
+    처음 올라온 사진이면 blob 을 등록하고, 같은 사진을 동시에 올린 다른 요청이 먼저 등록했으면 그 blob 을 쓰고 이 요청이 올린 object 는 commit 후 지움
+    """
+    urls = dict(urls)
+    own = urls.pop("own")
+    if urls["sha256"] is None:
+        return urls
+    cond = {"folder": folder_name, "sha256": urls["sha256"]}
+    if not crud.update_where(PhotoBlob, cond, {"ref_count": PhotoBlob.ref_count + 1}):
+        if urls["url"] not in own:
+            # 업로드를 건너뛰게 한 blob 이 그 사이에 지워짐
+            raise HTTPException(status_code=409, detail="Photo was removed while uploading, please retry")
+        if crud.insert_unique(PhotoBlob, photo.BlobUpload(folder=folder_name, **urls), savepoint=True) is not None:
+            return urls
+        crud.update_where(PhotoBlob, cond, {"ref_count": PhotoBlob.ref_count + 1})
+    blob = crud.get_record(PhotoBlob, cond)
+    unused = [url for url in own if url not in (blob.url, blob.thumbnail_url, blob.medium_url)]
+    if unused:
+        crud.on_commit(partial(storage.delete_later, [storage.key_of(url) for url in unused]))
+    return blob_urls(blob)
+
+
+def attach_blobs(crud, folder_name: str, uploaded: List[dict]) -> List[dict]:
+    """
+    여러 사진의 attach_blob, uploaded 와 같은 순서로 반환
+    여러 요청이 같은 blob 들을 잠글 때 deadlock 이 나지 않도록 sha256 순서로 처리
+    """
+    attached = [None] * len(uploaded)
+    for idx in sorted(range(len(uploaded)), key=lambda i: uploaded[i]["sha256"] or ""):
+        attached[idx] = attach_blob(crud, folder_name, uploaded[idx])
+    return attached
+
+
+def release_blob(crud, folder_name: str, sha256: Optional[str]):
+    """
+    사진 record 를 지울 때 참조 수를 하나 줄이고, 더 이상 가리키는 record 가 없으면 blob 을 지우고 commit 후 S3 object 도 지움
+    crud 의 transaction 안에서 호출해야 record 삭제와 참조 수가 같이 반영됨
+    """
+    if sha256 is None:
+        return
+    cond = {"folder": folder_name, "sha256": sha256}
+    crud.update_where(PhotoBlob, cond, {"ref_count": PhotoBlob.ref_count - 1})
+    blob = crud.get_record(PhotoBlob, cond)
+    if blob is None or blob.ref_count > 0:
+        return
+    keys = [storage.key_of(url) for url in (blob.url, blob.thumbnail_url, blob.medium_url) if url]
+    crud.delete_record(PhotoBlob, cond)
+    crud.on_commit(partial(storage.delete_later, keys))
+
+
+async def read_for_variants(file: UploadFile) -> Optional[bytes]:
+    """
+    변형을 만들 원본을 읽음, images.MAX_SOURCE_SIZE 보다 크면 읽다가 멈추고 None(변형 없이 원본 url 만 사용)
+    변형은 process pool 에서 만들어서 bytes 로 넘겨야 하므로, 동시에 메모리에 올라가는 원본 크기를 이 값으로 제한함
+    """
+    await file.seek(0)
+    data = await file.read(images.MAX_SOURCE_SIZE + 1)
+    if len(data) > images.MAX_SOURCE_SIZE:
+        return None
+    return data
+
+
+async def upload_photo(item: tuple, folder_name: str, blobs: Dict[str, dict]) -> dict:
+    """
+    (파일, SHA-256) 의 사진을 올리고 {"url", "thumbnail_url", "medium_url", "sha256", "own"} 반환, VARIANT_FOLDERS 면 변형도 만들어 올림
+    같은 내용의 사진이 blobs(find_blobs 의 결과)에 있으면 다시 올리지 않고 그 url 들을 사용
+    own 은 이 요청이 S3 에 올린 url 들, record 로 저장하기 전에 attach_blobs 로 넘겨야 함
+    """
+    file, sha256 = item
+    if sha256 in blobs:
+        return {**blobs[sha256], "own": []}
+    url = await upload_file(file, folder_name)
+    urls = {"url": url}
+    if folder_name in VARIANT_FOLDERS:
+        data = await read_for_variants(file)
+        if data is not None:
+            urls.update(await upload_variants(storage.key_of(url), data))
+    return {**urls, "sha256": sha256, "own": [url for url in urls.values() if url]}
+
+
+async def read_sha256(key: str) -> str:
+    return hashlib.sha256(await storage.read(key)).hexdigest()
+
+
+async def confirm_photo(item: tuple, folder_name: str, blobs: Dict[str, dict]) -> dict:
+    """
+    presigned 로 올라온 (key, SHA-256) 가 중복이면 기존 사진을 쓰고(올라온 object 는 attach_blobs 가 지움), 처음 올라온 사진이면 변형을 만들어 올림
+    confirm_uploads 로 확인한 key 에만 사용
+    """
+    key, sha256 = item
+    url = storage.public_url(key)
+    if sha256 in blobs:
+        return {**blobs[sha256], "own": [url]}
+    urls = {"url": url}
+    if folder_name in VARIANT_FOLDERS:
+        # 모든 원본을 한꺼번에 들고 있지 않도록 hash 를 계산할 때 읽은 내용은 버리고 변형이 필요한 사진만 다시 읽음
+        urls.update(await upload_variants(key, await storage.read(key)))
+    return {**urls, "sha256": sha256, "own": [url for url in urls.values() if url]}
+
+
+async def _run_limited(func, items: list, *args) -> list:
+    """
+    items 마다 func 를 동시에 실행하고 items 와 같은 순서로 결과를 반환
+    요청마다 storage.REQUEST_UPLOADS 개까지, process 전체로는 업로드 thread pool 크기(storage.UPLOAD_WORKERS)까지 동시에 올림
+    """
+    semaphore = asyncio.Semaphore(storage.REQUEST_UPLOADS)
+
+    async def run_one(item):
+        async with semaphore:
+            return await func(item, *args)
+
+    return list(await asyncio.gather(*[run_one(item) for item in items]))
+
+
+async def upload_photos(crud, files: List[UploadFile], folder_name: str) -> List[dict]:
+    """
+    여러 사진을 동시에 업로드하고 파일마다 upload_photo 의 결과를 files 와 같은 순서로 반환, 첫 번째 사진이 대표 사진이 됨
+    먼저 모든 파일의 SHA-256 을 계산해서 이미 있는 사진들을 find_blobs 한 번으로 찾음
+    """
+    for file in files:
+        check_size(file)
+    hashes = await asyncio.gather(*[storage.run_in_pool(storage.sha256, file.file) for file in files])
+    blobs = await find_blobs(crud, folder_name, hashes) if files else {}
+    return await _run_limited(upload_photo, list(zip(files, hashes)), folder_name, blobs)
+
+
+def upload_key(folder_name: str, account_id: int, filename: str) -> str:
+    """
+    presigned 업로드의 object key, 확인할 때 본인이 발급받은 key 인지 account_id 로 구분함
+    """
+    _, file_extension = os.path.splitext(filename)
+    file_extension = file_extension.lower()
+    if not re.fullmatch(r"\.[a-z0-9]{1,5}", file_extension):
+        file_extension = ""
+    return f"{folder_name}/{account_id}-{uuid.uuid4()}{file_extension}"
+
+
+async def confirm_uploads(keys: List[str], folder_name: str, account_id: int) -> List[str]:
+    """
+    클라이언트가 presigned url 로 올린 object 들을 동시에 확인하고 keys 와 같은 순서로 url 을 반환
+    """
+    prefix = f"{folder_name}/{account_id}-"
+    if any(not key.startswith(prefix) for key in keys):
+        raise HTTPException(status_code=403, detail="Key was not issued for this user")
     try:
-        # s3 클라이언트 생성
-        s3 = boto3.client(
-            service_name="s3",
-            region_name="ap-northeast-2",
-            aws_access_key_id=environ["S3_ACCESS"],
-            aws_secret_access_key=environ["S3_SECRET"],
-        )
-    except Exception as e:
-        print(e)
-    else:
-        _, file_extension = os.path.splitext(file.filename)
-        random_file_name = f"{folder_name}/{str(uuid.uuid4()) + file_extension}"
-        s3.upload_fileobj(file.file, "dangmuzi-photo", random_file_name)
-        return "https://dangmuzi-photo.s3.ap-northeast-2.amazonaws.com/"+random_file_name
+        return list(await asyncio.gather(*[storage.verify(key) for key in keys]))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=f"Uploaded file not found: {e}")
+    except storage.FileTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except storage.UnsupportedFile as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+
+async def confirm_photos(crud, keys: List[str], folder_name: str, account_id: int) -> List[dict]:
+    """
+    Photo, MPhoto 용 confirm_uploads, 파일마다 upload_photo 와 같은 형태의 dict 를 keys 와 같은 순서로 반환
+    """
+    await confirm_uploads(keys, folder_name, account_id)
+    hashes = await _run_limited(read_sha256, keys)
+    blobs = await find_blobs(crud, folder_name, hashes) if keys else {}
+    return await _run_limited(confirm_photo, list(zip(keys, hashes)), folder_name, blobs)
+
+
+@router.post(
+    "/presign",
+    name="S3 직접 업로드용 presigned url 발급",
+    description="사진을 API 서버를 거치지 않고 S3 에 직접 올릴 수 있는 presigned POST 를 발급합니다.\n\n"
+                "folder는 post, message, profile, auth 중 하나이고, filenames는 올릴 파일 이름 목록입니다(최대 10개).\n\n"
+                "응답의 url 로 fields 를 모두 form 에 담고 Content-Type(image/...)과 file 을 마지막에 붙여 POST 하면 됩니다. "
+                "업로드가 끝나면 key 를 각 confirm API(/photo/confirm, /chat/photo_chat/confirm, "
+                "/account/set_user_profile_photo/confirm, /locker/locker_auth/confirm)로 보내야 기록됩니다.",
+    response_model=photo.PresignResponse,
+)
+async def presign_upload(req: photo.PresignRequest, current_user: Account = Depends(get_current_user)):
+    if req.folder not in PRESIGN_FOLDERS:
+        raise HTTPException(status_code=400, detail=f"Unsupported folder: {req.folder}")
+    keys = [upload_key(req.folder, current_user.account_id, filename) for filename in req.filenames]
+    presigned = await asyncio.gather(*[storage.run_in_pool(storage.presign_post, key) for key in keys])
+    return photo.PresignResponse(
+        items=[photo.PresignedUpload(key=key, url=item["url"], fields=item["fields"]) for key, item in zip(keys, presigned)]
+    )
 
 
 
@@ -50,18 +293,44 @@ async def upload_file(file: File(...), folder_name: str):
     "/", name="Photo record 생성", description="Photo 테이블에 Record 생성합니다\n"
                                              "여러장 가능합니다."
 )
-async def create_post(req: photo.PhotoUpload = Depends(), files: List[UploadFile] = File(...), current_user: Account = Depends(get_current_user), crud=Depends(get_crud)):
-    for idx, file in enumerate(files):
-        url = await upload_file(file, "post")
-        temp = photo.PhotoComplete(**req.dict(), url=url, account_id=current_user.account_id)
-        if idx == 0:
-            temp = crud.create_record(Photo, temp)
-            rep_photo_id = temp.photo_id
-        else:
-            crud.create_record(Photo, temp)
+async def create_post(req: photo.PhotoUpload = Depends(), files: List[UploadFile] = File(...), current_user: Account = Depends(get_current_user), crud=Depends(get_uow_crud)):
+    temp_post = crud.get_record(Post, {"post_id": req.post_id})
+    if temp_post is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    uploaded = await upload_photos(crud, files, "post")
+    photos = [
+        photo.PhotoComplete(**req.dict(), **urls, account_id=current_user.account_id)
+        for urls in attach_blobs(crud, "post", uploaded)
+    ]
+    photo_ids = crud.create_many(Photo, photos, commit=False)
+    request = {"representative_photo_id": photo_ids[0]}
+    crud.patch_record(temp_post, request)
+    crud.commit()
+    return temp_post
+
+
+@router.post(
+    "/confirm", name="presigned 업로드한 Photo record 생성",
+    description="/photo/presign 으로 받은 url 에 post 폴더로 올린 사진들을 Photo 테이블에 기록합니다.\n\n"
+                "keys의 순서대로 저장되며 첫 번째 사진이 대표 사진이 됩니다. 본인의 게시물에만 가능합니다.",
+    response_model=post.ReadPost
+)
+async def confirm_post(req: photo.ConfirmPhotos, current_user: Account = Depends(get_current_user), crud=Depends(get_uow_crud)):
     temp_post = crud.get_record(Post, {"post_id": req.post_id})
-    request = post.PhotoPost(representative_photo_id=rep_photo_id)
-    return crud.patch_record(temp_post, request)
+    if temp_post is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    if temp_post.account_id != current_user.account_id:
+        raise HTTPException(status_code=401, detail="Unauthorized request")
+    uploaded = await confirm_photos(crud, req.keys, "post", current_user.account_id)
+    photos = [
+        photo.PhotoComplete(post_id=temp_post.post_id, category_id=temp_post.category_id, **urls, account_id=current_user.account_id)
+        for urls in attach_blobs(crud, "post", uploaded)
+    ]
+    photo_ids = crud.create_many(Photo, photos, commit=False)
+    request = {"representative_photo_id": photo_ids[0]}
+    crud.patch_record(temp_post, request)
+    crud.commit()
+    return temp_post
 
 
 @router.post(
@@ -69,7 +338,8 @@ async def create_post(req: photo.PhotoUpload = Depends(), files: List[UploadFile
     name="Photo Page 리스트 조회",
     description="Photo 테이블의 페이지별 Record list 가져오는 API입니다.\
                 Page는 0이 아닌 양수로 입력해야합니다\
-                Size는 100개로 제한됩니다.",
+                Size는 100개로 제한됩니다." + PAGE_LIST_DEPRECATED,
+    deprecated=True,
 )
 async def page_post(req: RequestPage, crud=Depends(get_crud)):
     if req.page <= 0:
@@ -81,32 +351,52 @@ async def page_post(req: RequestPage, crud=Depends(get_crud)):
     return crud.paging_record(Photo, req)
 
 
+@router.post(
+    "/cursor-list",
+    name="Photo cursor 리스트 조회",
+    description=cursor_list_description("Photo"),
+)
+async def cursor_photo(req: RequestCursor, crud=Depends(get_crud)):
+    if req.size > 100:
+        raise HTTPException(status_code=400, detail="Size should be below 100")
+    if req.size <= 0:
+        raise HTTPException(status_code=400, detail="Size should be positive")
+    try:
+        return crud.cursor_paging_record(Photo, req)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.post(
     "/search",
     name="Photo 테이블에서 입력한 조건들에 부합하는 record 를 반환하는 API",
-    description="body에 원하는 조건들을 입력하면 and로 필터 결과 리스트를 반환합니다\
-        조건값이 str 일 경우 그 문자열을 포함하는 모든 record를 반환합니다.\
-        조건값이 int,float 일 경우 그 값과 동일한 record만 반환합니다.\
-        조건값이 list 경우 list 항목을 포함하는 모든 record를 반환합니다.\
-    ",
+    description=search_description(SEARCH_FIELDS),
     response_model=List[photo.ReadPhoto],
 )
-async def search_post(filters: dict, crud=Depends(get_crud)):
-    return crud.search_record(Photo, filters)
+async def search_post(response: Response, filters: dict, limit: int = SEARCH_LIMIT, cursor: Optional[str] = None, crud=Depends(get_crud)):
+    try:
+        page = crud.filter_record(Photo, filters, SEARCH_FIELDS, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["items"]
 
 
 @router.post(
     "/m_search",
     name="message Photo 테이블에서 입력한 조건들에 부합하는 record 를 반환하는 API",
-    description="body에 원하는 조건들을 입력하면 and로 필터 결과 리스트를 반환합니다\
-        조건값이 str 일 경우 그 문자열을 포함하는 모든 record를 반환합니다.\
-        조건값이 int,float 일 경우 그 값과 동일한 record만 반환합니다.\
-        조건값이 list 경우 list 항목을 포함하는 모든 record를 반환합니다.\
-    ",
+    description=search_description(M_SEARCH_FIELDS),
     response_model=List[photo.MPhotoRead],
 )
-async def search_post(filters: dict, crud=Depends(get_crud)):
-    return crud.search_record(MPhoto, filters)
+async def search_post(response: Response, filters: dict, limit: int = SEARCH_LIMIT, cursor: Optional[str] = None, crud=Depends(get_crud)):
+    try:
+        page = crud.filter_record(MPhoto, filters, M_SEARCH_FIELDS, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["items"]
 
 @router.get(
     "/list",
@@ -135,11 +425,18 @@ def read_post(id: int, crud=Depends(get_crud)):
 @router.delete(
     "/{id}",
     name="Photo record 삭제",
-    description="입력된 id에 해당하는 record를 삭제합니다.",
+    description="입력된 id에 해당하는 record를 삭제합니다. 본인이 올린 사진만 삭제할 수 있습니다.",
 )
-async def delete_post(id: int, crud=Depends(get_crud)):
+async def delete_post(id: int, crud=Depends(get_uow_crud), current_user: Account = Depends(get_current_user)):
     filter = {"photo_id": id}
-    db_api = crud.delete_record(Photo, filter)
-    if db_api != 1:
+    db_record = crud.get_record(Photo, filter)
+    if db_record is None:
         raise HTTPException(status_code=404, detail="Record not found")
+    if db_record.account_id != current_user.account_id:
+        raise HTTPException(status_code=401, detail="Unauthorized request")
+    sha256 = db_record.sha256
+    crud.delete_record(Photo, filter)
+    # 같은 사진을 쓰는 다른 record 가 없을 때만 S3 object 를 지움
+    release_blob(crud, "post", sha256)
+    crud.commit()
     return Response(status_code=HTTP_204_NO_CONTENT)
@@ -4,16 +4,17 @@ from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Body
 from starlette.responses import Response
 from starlette.status import HTTP_204_NO_CONTENT, HTTP_401_UNAUTHORIZED
 
-from core.schema import RequestPage
-from core.utils import get_crud
+from core.schema import RequestPage, RequestCursor, SEARCH_LIMIT, PAGE_LIST_DEPRECATED, cursor_list_description, search_description
+from core.filters import INT_OPS, STR_OPS
+from core.utils import get_crud, get_async_crud, get_uow_crud
 from models.photo import Photo
-from models.post import Post
+from models.post import Post, PostCounter
 from models.liked import Liked
 from models.chat import Room
 from models.locker import Locker
 from schemas import post, photo
 from routers.account import get_current_user
-from routers.photo import upload_file
+from routers.photo import upload_photos, attach_blobs
 from models.account import Account
 from typing import Optional
 
@@ -27,6 +28,28 @@ router = APIRouter(
 Post table CRUD
 """
 
+SEARCH_FIELDS = {
+    "post_id": INT_OPS, "title": STR_OPS, "price": INT_OPS, "description": STR_OPS, "category_id": INT_OPS,
+    "representative_photo_id": INT_OPS, "status": INT_OPS, "account_id": INT_OPS, "use_locker": INT_OPS,
+    "username": STR_OPS, "buyer": INT_OPS, "liked": INT_OPS,
+}
+
+
+async def with_variants(crud, page: dict) -> dict:
+    """
+    feed 의 게시물마다 대표 사진의 thumbnail, medium url 을 붙임, 대표 사진들은 한 번에 조회
+    """
+    ids = [item.representative_photo_id for item in page["items"] if item.representative_photo_id]
+    photos = {record.photo_id: record for record in await crud.search_in(Photo, "photo_id", ids)}
+    items = []
+    for item in page["items"]:
+        representative = photos.get(item.representative_photo_id)
+        variants = {}
+        if representative is not None:
+            variants = {"thumbnail_url": representative.thumbnail_url, "medium_url": representative.medium_url}
+        items.append(post.Item.from_orm(item).copy(update=variants))
+    return {**page, "items": items}
+
 
 @router.post(
     "/create_post",
@@ -102,33 +125,34 @@ async def create_post(req: post.BasePost, crud=Depends(get_crud), current_user:
                  }
              }
 )
-async def create_with_photo(req: post.BasePost = Depends(), files: Optional[List[UploadFile]] = None, crud=Depends(get_crud), current_user: Account = Depends(get_current_user)):
+async def create_with_photo(req: post.BasePost = Depends(), files: Optional[List[UploadFile]] = None, crud=Depends(get_uow_crud), current_user: Account = Depends(get_current_user)):
+    # 업로드를 먼저 끝내서 S3 를 기다리는 동안 transaction 을 열어두지 않음
+    uploaded = await upload_photos(crud, files or [], "post")
     upload = post.PhotoPost(**req.dict(), representative_photo_id=0, account_id=current_user.account_id, username=current_user.username)
     temp_post = crud.create_record(Post, upload)
     search_id = temp_post.post_id
-    if not files:
+    if not uploaded:
+        crud.commit()
         return temp_post
-    for idx, file in enumerate(files):
-        url = await upload_file(file, "post")
-        temp_photo = photo.PhotoComplete(
+    photos = [
+        photo.PhotoComplete(
             post_id=temp_post.post_id,
             category_id=temp_post.category_id,
-            url=url,
-            account_id=current_user.account_id
+            account_id=current_user.account_id,
+            **urls
         )
-        if idx == 0:
-            temp = crud.create_record(Photo, temp_photo)
-            rep_photo_id = temp.photo_id
-        else:
-            crud.create_record(Photo, temp_photo)
-    request = {"representative_photo_id": rep_photo_id}
+        for urls in attach_blobs(crud, "post", uploaded)
+    ]
+    photo_ids = crud.create_many(Photo, photos)
+    request = {"representative_photo_id": photo_ids[0]}
     crud.patch_record(temp_post, request)
     if req.locker_id:
         to_reserve = crud.get_record(Locker, {"locker_id": req.locker_id})
         if not to_reserve:
             raise HTTPException(status_code=404, detail="no locker available")
         crud.patch_record(to_reserve, {"post_id": search_id})
-    return crud.get_record(Post, {"post_id": search_id})
+    crud.commit()
+    return temp_post
 
 
 @router.post(
@@ -137,7 +161,8 @@ async def create_with_photo(req: post.BasePost = Depends(), files: Optional[List
     description="Post 테이블의 페이지별 Record list 가져오는 API입니다.\
                 Page는 0이 아닌 양수로 입력해야합니다\
                 Size는 100개로 제한됩니다.\n\n"
-                "웹 페이지의 게시글 리스트 조회 형식이므로 앱에서는 사용을 비추천합니다.",
+                "웹 페이지의 게시글 리스트 조회 형식이므로 앱에서는 사용을 비추천합니다." + PAGE_LIST_DEPRECATED,
+    deprecated=True,
     response_model=post.ResponseModel
 )
 async def page_post(req: RequestPage, crud=Depends(get_crud)):
@@ -150,6 +175,23 @@ async def page_post(req: RequestPage, crud=Depends(get_crud)):
     return crud.paging_record(Post, req)
 
 
+@router.post(
+    "/cursor-list",
+    name="Post cursor 리스트 조회",
+    description=cursor_list_description("Post"),
+    response_model=post.CursorResponseModel
+)
+async def cursor_post(req: RequestCursor, crud=Depends(get_crud)):
+    if req.size > 100:
+        raise HTTPException(status_code=400, detail="Size should be below 100")
+    if req.size <= 0:
+        raise HTTPException(status_code=400, detail="Size should be positive")
+    try:
+        return crud.cursor_paging_record(Post, req)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get(
     "/app-paging",
     name="app을 위한 paging method",
@@ -160,7 +202,11 @@ async def page_post(req: RequestPage, crud=Depends(get_crud)):
                 "checkpoint query값으로 활용하면 됩니다. 이는 페이징 로딩중에 새로운 게시물이 올라와도 중복해서 게시물을 로드 하지 않도록 하는 "
                 "checkpoint 값입니다.\n\n"
                 "성능 유지를 위해 size는 최대 99개의 요청까지 수용 가능합니다.\n\n"
-                "가장 최신의 게시물부터 가져오며, 가장 끝의 게시물을 가져오게 되면 \"next_checkpoint\" 값이 -1로 반환됩니다.",
+                "가장 최신의 게시물부터 가져오며, 가장 끝의 게시물을 가져오게 되면 \"next_checkpoint\" 값이 -1로 반환됩니다.\n\n"
+                "cursor(str, None) - checkpoint 대신 사용할 수 있는 cursor 방식입니다. 응답의 \"next_cursor\" 값을 다음 요청의 cursor "
+                "query값으로 넣으면 됩니다. 첫 요청은 cursor를 빈 값(cursor=)으로 보내면 됩니다. cursor 방식에서는 게시물 수를 세지 않고 "
+                "마지막으로 받은 게시물 다음부터 바로 읽기 때문에 게시물이 추가, 삭제되어도 밀리지 않고 깊은 페이지도 빠르게 응답합니다. "
+                "이때 \"next_checkpoint\"는 null이며, 더 가져올 게시물이 없으면 \"next_cursor\"가 null로 반환됩니다.",
     response_model=post.AppResponseModel,
     responses={
         200: {
@@ -260,15 +306,20 @@ async def page_post(req: RequestPage, crud=Depends(get_crud)):
         },
     }
 )
-async def app_page_listing(size: int, checkpoint: Optional[int] = None, crud=Depends(get_crud)):
+async def app_page_listing(size: int, checkpoint: Optional[int] = None, cursor: Optional[str] = None, crud=Depends(get_async_crud)):
     if size > 100:
         raise HTTPException(status_code=400, detail="Size should be below 100")
     if size <= 0:
         raise HTTPException(status_code=400, detail="Size should be positive")
+    if cursor is not None:
+        try:
+            return await with_variants(crud, await crud.app_cursor_record(Post, size, cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     if checkpoint:
-        return crud.app_paging_record(Post, size, checkpoint)
+        return await with_variants(crud, await crud.app_paging_record(Post, size, checkpoint, counter=PostCounter))
     else:
-        return crud.app_paging_record(Post, size)
+        return await with_variants(crud, await crud.app_paging_record(Post, size, counter=PostCounter))
 
 
 @router.get(
@@ -381,15 +432,15 @@ async def app_page_listing(size: int, checkpoint: Optional[int] = None, crud=Dep
         },
     }
 )
-async def house_app_page_listing(size: int, checkpoint: Optional[int] = None, crud=Depends(get_crud)):
+async def house_app_page_listing(size: int, checkpoint: Optional[int] = None, crud=Depends(get_async_crud)):
     if size > 100:
         raise HTTPException(status_code=400, detail="Size should be below 100")
     if size <= 0:
         raise HTTPException(status_code=400, detail="Size should be positive")
     if checkpoint:
-        return crud.house_paging_record(Post, size, checkpoint)
+        return await with_variants(crud, await crud.house_paging_record(Post, size, checkpoint, counter=PostCounter))
     else:
-        return crud.house_paging_record(Post, size)
+        return await with_variants(crud, await crud.house_paging_record(Post, size, counter=PostCounter))
 
 
 @router.get(
@@ -502,15 +553,15 @@ async def house_app_page_listing(size: int, checkpoint: Optional[int] = None, cr
         },
     }
 )
-async def house_app_page_listing(category: int, size: int, checkpoint: Optional[int] = None, crud=Depends(get_crud)):
+async def house_app_page_listing(category: int, size: int, checkpoint: Optional[int] = None, crud=Depends(get_async_crud)):
     if size > 100:
         raise HTTPException(status_code=400, detail="Size should be below 100")
     if size <= 0:
         raise HTTPException(status_code=400, detail="Size should be positive")
     if checkpoint:
-        return crud.house_category_record(Post, category, size, checkpoint)
+        return await with_variants(crud, await crud.house_category_record(Post, category, size, checkpoint, counter=PostCounter))
     else:
-        return crud.house_category_record(Post, category, size)
+        return await with_variants(crud, await crud.house_category_record(Post, category, size, counter=PostCounter))
 
 
 @router.post(
@@ -530,16 +581,14 @@ async def not_yet_auth_mypost(crud=Depends(get_crud), current_user: Account = De
 @router.post(
     "/search",
     name="Post 테이블에서 입력한 조건들에 부합하는 record 를 반환하는 API",
-    description="body에 원하는 조건들을 입력하면 and로 필터 결과 리스트를 반환합니다\n\n"
-                "조건값이 str 일 경우 그 문자열을 포함하는 모든 record를 반환합니다.\n\n"
-                "조건값이 int,float 일 경우 그 값과 동일한 record만 반환합니다.\n\n"
-                "조건값이 list 경우 list 항목을 포함하는 모든 record를 반환합니다.\n\n"
-                "조건값은 dictionary 형태로 모델에서 검색가능한 [post_id, title, price, description, representative_photo_id, "
-                "status, account_id, username, liked]\n\n"
-                "위와 같은 목록들을 검색할 수 있습니다. 원하는 필드만 넣어서 검색할 수 있습니다.",
+    description=search_description(SEARCH_FIELDS) + "\n\n"
+                "**Deprecated**: title, description 의 문자열 포함 검색은 index를 쓰지 못해 느립니다. "
+                "키워드 검색은 /post/text_search를 사용해주세요.",
+    deprecated=True,
     response_model=List[post.PatchPost],
 )
 async def search_post(
+        response: Response,
         filters: dict = Body(..., examples=[{
             "post_id": 1,
             "title": "post title example",
@@ -551,8 +600,37 @@ async def search_post(
             "use_locker": 0,
             "username": "이재선",
             "liked": 3
-        }]), crud=Depends(get_crud)):
-    return crud.search_record(Post, filters)
+        }]), limit: int = SEARCH_LIMIT, cursor: Optional[str] = None, crud=Depends(get_crud)):
+    try:
+        page = crud.filter_record(Post, filters, SEARCH_FIELDS, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["items"]
+
+
+@router.get(
+    "/text_search",
+    name="Post 제목, 내용 키워드 검색",
+    description="게시물의 title과 description에서 keyword를 검색하여 관련도가 높은 순서로 반환합니다.\n\n"
+                "keyword(str) - 검색어, 띄어쓰기로 여러 단어를 검색할 수 있습니다.\n\n"
+                "size(int) - 받고자 하는 검색 결과 양, 최대 100개까지 가능합니다.\n\n"
+                "cursor(str, None) - 응답의 next_cursor 값을 넣으면 다음 검색 결과를 이어서 가져옵니다. 처음 요청할 때는 넣지 않아도 됩니다."
+                "더 가져올 결과가 없으면 next_cursor가 null로 반환됩니다.",
+    response_model=post.SearchResponseModel,
+)
+async def text_search_post(keyword: str, size: int = 20, cursor: Optional[str] = None, crud=Depends(get_async_crud)):
+    if size > 100:
+        raise HTTPException(status_code=400, detail="Size should be below 100")
+    if size <= 0:
+        raise HTTPException(status_code=400, detail="Size should be positive")
+    if not keyword.strip():
+        raise HTTPException(status_code=400, detail="Keyword should not be empty")
+    try:
+        return await crud.text_search_record(Post, ["title", "description"], keyword, size, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 @router.post(
@@ -782,7 +860,7 @@ async def update_post_sub(id: int, req: dict = Body(..., examples=[{
                  }
              }
 )
-async def update_post_sub(room_id: str, crud=Depends(get_crud), current_user: Account = Depends(get_current_user)):
+async def update_post_sub(room_id: str, crud=Depends(get_uow_crud), current_user: Account = Depends(get_current_user)):
     filter = {"room_id": room_id}
     db_record: Room = crud.get_record(Room, filter)
     if db_record is None:
@@ -796,6 +874,7 @@ async def update_post_sub(room_id: str, crud=Depends(get_crud), current_user: Ac
         locker_record: Locker = crud.get_record(Locker, {"locker_id": post_record.locker_id})
         crud.patch_record(locker_record, {"status": 1, "post_id": None, "account_id": None})
 
+    crud.commit()
     return res
 
 
@@ -824,18 +903,15 @@ async def delete_post(id: int, crud=Depends(get_crud), current_user: Account = D
     name="Post like +1",
     description="입력된 id에 해당하는 post의 좋아요를 사용자의 계정으로 1개 증가시킵니다.",
 )
-async def like_up(id: int, crud=Depends(get_crud), current_user: Account = Depends(get_current_user)):
-    filter = {"post_id": id}
-    db_record = crud.get_record(Post, filter)
-    if db_record is None:
+async def like_up(id: int, crud=Depends(get_uow_crud), current_user: Account = Depends(get_current_user)):
+    # 좋아요 수는 DB 에서 증가시키고, 중복은 liked 의 unique 제약으로 판단 (중복이면 증가분도 함께 rollback)
+    if crud.update_where(Post, {"post_id": id}, {"liked": Post.liked + 1}) == 0:
         raise HTTPException(status_code=404, detail="Record not found")
-    filter_model = post.LikedPatch(post_id=id, account_id=current_user.account_id)
-    is_duplicated = crud.search_record(Liked, filter_model)
-    if is_duplicated:
+    db_record = crud.insert_unique(Liked, post.LikedPatch(post_id=id, account_id=current_user.account_id))
+    if db_record is None:
         raise HTTPException(status_code=409, detail="You already like it")
-    patch = {"liked": db_record.liked+1}
-    crud.patch_record(db_record, patch)
-    return crud.create_record(Liked, post.LikedPatch(post_id=id, account_id=current_user.account_id))
+    crud.commit()
+    return db_record
 
 
 @router.post(
@@ -843,17 +919,12 @@ async def like_up(id: int, crud=Depends(get_crud), current_user: Account = Depen
     name="Post like -1",
     description="이전에 입력된 id에 해당하는 post에 추가된 좋아요를 사용자의 계정으로 1개 감소시킵니다.",
 )
-async def like_back(id: int, crud=Depends(get_crud), current_user: Account = Depends(get_current_user)):
+async def like_back(id: int, crud=Depends(get_uow_crud), current_user: Account = Depends(get_current_user)):
     filter = {"post_id": id, "account_id": current_user.account_id}
-    db_record = crud.search_record(Liked, filter)
-    if len(db_record) < 1:
-        raise HTTPException(status_code=404, detail="Record not found")
-    post_record = crud.get_record(Post, {"post_id": id})
-    patch = {"liked": post_record.liked-1}
-    crud.patch_record(post_record, patch)
-    db_api = crud.delete_record(Liked, {"liked_id": db_record[0].liked_id})
-    if db_api != 1:
+    if crud.delete_where(Liked, filter) == 0:
         raise HTTPException(status_code=404, detail="Record not found")
+    crud.update_where(Post, {"post_id": id}, {"liked": Post.liked - 1})
+    crud.commit()
     return Response(status_code=HTTP_204_NO_CONTENT)
 
 @router.post(
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import Optional, List
 
 from pydantic import BaseModel, Field
 
@@ -44,6 +44,13 @@ class ReadAccount(BaseModel):
         orm_mode = True
 
 
+class CursorAccount(BaseModel):
+    items: List[ReadAccount]
+    next_cursor: Optional[str]
+    size: int
+    total_row: Optional[int]
+
+
 class PatchAccount(BaseModel):
     available: Optional[bool]
     jail_until: Optional[datetime]
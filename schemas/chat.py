@@ -99,6 +99,36 @@ class RoomStatus(BaseModel):
         orm_mode = True
 
 
+class InboxRoom(BaseModel):
+    room_id: str
+    post_id: int
+    iam_buyer: bool
+    repr_photo_id: int
+    username: Optional[str]
+    profile_url: Optional[str]
+    last_message: Union[str, None, List[str]]
+    update_time: Optional[datetime]
+    count: int
+
+    class Config:
+        orm_mode = True
+
+
+class Inbox(BaseModel):
+    items: List[InboxRoom]
+    next_cursor: Optional[str]
+
+    class Config:
+        orm_mode = True
+
+
+class MessageIDs(BaseModel):
+    message_ids: List[int]
+
+    class Config:
+        orm_mode = True
+
+
 class RoomIDs(BaseModel):
     room_ids: List[str]
 
@@ -32,6 +32,10 @@ class LockerAuth(BaseModel):
         orm_mode = True
 
 
+class AuthConfirm(LockerAuth):
+    key: str
+
+
 class AuthUpload(LockerAuth):
     photo_url: str
 
@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 """
@@ -19,11 +19,16 @@ class PhotoUpload(BaseModel):
 
 class PhotoComplete(PhotoUpload):
     url: str
+    thumbnail_url: Optional[str]
+    medium_url: Optional[str]
+    sha256: Optional[str]
     account_id: int
 
 
 class ReadPhoto(BaseModel):
     url: str
+    thumbnail_url: Optional[str]
+    medium_url: Optional[str]
     create_time: datetime
 
     class Config:
@@ -49,6 +54,7 @@ class MPhotoUpload(BaseModel):
     url: str
     room_id: str
     account_id: int
+    sha256: Optional[str]
 
     class Config:
         orm_mode = True
@@ -60,3 +66,41 @@ class MPhotoRead(MPhotoUpload):
 
     class Config:
         orm_mode = True
+
+
+class PresignRequest(BaseModel):
+    folder: str
+    filenames: List[str] = Field(..., min_items=1, max_items=10)
+
+
+class PresignedUpload(BaseModel):
+    key: str
+    url: str
+    fields: Dict[str, str]
+
+
+class PresignResponse(BaseModel):
+    items: List[PresignedUpload]
+
+
+class ConfirmPhotos(BaseModel):
+    post_id: int
+    keys: List[str] = Field(..., min_items=1, max_items=10)
+
+
+class ConfirmMPhotos(BaseModel):
+    room_id: str
+    keys: List[str] = Field(..., min_items=1, max_items=10)
+
+
+class ConfirmPhoto(BaseModel):
+    key: str
+
+
+class BlobUpload(BaseModel):
+    folder: str
+    sha256: str
+    url: str
+    thumbnail_url: Optional[str]
+    medium_url: Optional[str]
+    ref_count: int = 1
@@ -84,6 +84,8 @@ class Item(BaseModel):
     update_time: datetime
     title: str
     representative_photo_id: Optional[int]
+    thumbnail_url: Optional[str]
+    medium_url: Optional[str]
     status: int
     use_locker: int
     username: str
@@ -102,7 +104,20 @@ class ResponseModel(BaseModel):
     total_row: int
 
 
+class CursorResponseModel(BaseModel):
+    items: List[Item]
+    next_cursor: Optional[str]
+    size: int
+    total_row: Optional[int]
+
+
+class SearchResponseModel(BaseModel):
+    items: List[Item]
+    next_cursor: Optional[str]
+
+
 class AppResponseModel(BaseModel):
     items: List[Item]
-    next_checkpoint: int
+    next_checkpoint: Optional[int]
+    next_cursor: Optional[str] = None
 
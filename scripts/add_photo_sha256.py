@@ -0,0 +1,24 @@
+"""
+중복 사진 index(photo_blob) table 과 photo, m_photo 의 sha256 column 을 추가하는 일회성 작업
+프로젝트 루트에서 python -m scripts.add_photo_sha256 로 실행, 기존 사진은 sha256 이 NULL 인 채로 두어 참조 수를 세지 않음(S3 에서 지우지 않음)
+"""
+from sqlalchemy import inspect, text
+
+from core.db import engine, Base
+from models.photo import Photo, MPhoto, PhotoBlob
+
+
+def add_columns():
+    """
+    create_all 은 이미 있는 table 에 column 을 추가하지 않으므로 sha256 column 이 없으면 추가
+    """
+    Base.metadata.create_all(bind=engine, tables=[PhotoBlob.__table__])
+    with engine.begin() as conn:
+        for table in (Photo, MPhoto):
+            columns = [column["name"] for column in inspect(conn).get_columns(table.__tablename__)]
+            if "sha256" not in columns:
+                conn.execute(text(f"ALTER TABLE {table.__tablename__} ADD COLUMN sha256 CHAR(64) NULL"))
+
+
+if __name__ == "__main__":
+    add_columns()
@@ -0,0 +1,78 @@
+"""
+오래 활동이 없는 닫힌 채팅방의 메시지를 message 에서 message_archive 로 옮기는 작업
+닫힌 채팅방: 아무도 읽을 수 없는 방(Room.status == -1) 이나 거래 완료된 게시물(Post.status == 2)의 방
+프로젝트 루트에서 python -m scripts.archive_messages [--days 90] 로 주기적으로 실행, 방 하나씩 transaction 으로 옮기므로 중간에 멈춰도 됨
+"""
+import argparse
+from datetime import timedelta
+from os import environ
+
+from sqlalchemy import and_, delete, exists, func, insert, or_, select
+
+from core.db import engine, Base
+from models.chat import Message, MessageArchive, Room
+from models.post import Post
+
+ARCHIVE_AFTER_DAYS = int(environ.get("ARCHIVE_AFTER_DAYS", 90))
+BATCH_SIZE = 100
+
+COLUMNS = ["message_id", "room_id", "is_from_buyer", "is_photo", "content", "read", "photo_urls", "create_time"]
+
+
+def find_rooms(conn, cutoff, limit: int):
+    """
+    cutoff 이후로 메시지도 방 변경도 없는 닫힌 채팅방 중 아직 message 에 메시지가 남은 방
+    """
+    message = Message.__table__
+    room = Room.__table__
+    post = Post.__table__
+    stmt = (
+        select(room.c.room_id)
+        .join(post, post.c.post_id == room.c.post_id)
+        .where(
+            or_(room.c.status == -1, post.c.status == 2),
+            room.c.update_time < cutoff,
+            exists().where(message.c.room_id == room.c.room_id),
+            ~exists().where(and_(message.c.room_id == room.c.room_id, message.c.create_time >= cutoff)),
+        )
+        .limit(limit)
+    )
+    return conn.execute(stmt).scalars().all()
+
+
+def archive_room(room_id: str):
+    """
+    채팅방 하나의 메시지를 한 transaction 안에서 message_archive 로 복사하고 message 에서 지움
+    복사한 message_id 까지만 지워서, 복사하는 사이에 새로 들어온 메시지는 message 에 남김
+    """
+    message = Message.__table__
+    archive = MessageArchive.__table__
+    with engine.begin() as conn:
+        last_id = conn.execute(select(func.max(message.c.message_id)).where(message.c.room_id == room_id)).scalar()
+        if last_id is None:
+            return 0
+        copied = and_(message.c.room_id == room_id, message.c.message_id <= last_id)
+        conn.execute(insert(archive).from_select(COLUMNS, select(*[message.c[name] for name in COLUMNS]).where(copied)))
+        return conn.execute(delete(message).where(copied)).rowcount
+
+
+def archive(days: int):
+    Base.metadata.create_all(bind=engine, tables=[MessageArchive.__table__])
+    with engine.connect() as conn:
+        cutoff = conn.execute(select(func.now())).scalar() - timedelta(days=days)
+    moved = 0
+    while True:
+        with engine.connect() as conn:
+            rooms = find_rooms(conn, cutoff, BATCH_SIZE)
+        if not rooms:
+            break
+        for room_id in rooms:
+            moved += archive_room(room_id)
+        print(f"archived {moved} messages ({len(rooms)} rooms in this batch)")
+    print(f"done: archived {moved} messages older than {cutoff}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="닫힌 채팅방의 오래된 메시지를 message_archive 로 옮김")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="마지막 활동 후 보관까지의 기간(일)")
+    archive(parser.parse_args().days)
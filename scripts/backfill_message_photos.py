@@ -0,0 +1,57 @@
+"""
+사진 메시지의 url 리스트를 Message.content 의 Python 리스트 문자열에서 photo_urls JSON column 으로 옮기는 일회성 작업
+프로젝트 루트에서 python -m scripts.backfill_message_photos 로 실행, 중간에 멈춰도 다시 실행하면 남은 메시지부터 이어서 처리
+"""
+import ast
+
+from sqlalchemy import inspect, select, text, update
+
+from core.db import engine
+from models.chat import Message
+
+BATCH_SIZE = 1000
+
+
+def add_column():
+    """
+    create_all 은 이미 있는 table 에 column 을 추가하지 않으므로 photo_urls column 이 없으면 추가
+    """
+    columns = [column["name"] for column in inspect(engine).get_columns(Message.__tablename__)]
+    if "photo_urls" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE message ADD COLUMN photo_urls JSON NULL"))
+
+
+def backfill():
+    message = Message.__table__
+    last_id = 0
+    converted = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(message.c.message_id, message.c.content)
+                .where(message.c.message_id > last_id, message.c.is_photo == 1, message.c.photo_urls.is_(None))
+                .order_by(message.c.message_id)
+                .limit(BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            for message_id, content in rows:
+                if content == "img":
+                    continue
+                try:
+                    urls = ast.literal_eval(content)
+                except (ValueError, SyntaxError):
+                    print(f"skip message {message_id}: content is not a list")
+                    continue
+                if isinstance(urls, str):
+                    urls = [urls]
+                conn.execute(update(message).where(message.c.message_id == message_id).values(photo_urls=list(urls)))
+                converted += 1
+            last_id = rows[-1].message_id
+        print(f"converted {converted} messages (up to message_id {last_id})")
+
+
+if __name__ == "__main__":
+    add_column()
+    backfill()
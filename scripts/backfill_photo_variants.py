@@ -0,0 +1,66 @@
+"""
+이미 올라와 있는 게시물 사진에 thumbnail, medium 변형을 만들어 붙이는 일회성 작업
+프로젝트 루트에서 python -m scripts.backfill_photo_variants 로 실행, 중간에 멈춰도 다시 실행하면 남은 사진부터 이어서 처리
+"""
+import asyncio
+
+from sqlalchemy import inspect, select, text, update
+
+from core import images, storage
+from core.db import engine
+from models.photo import Photo
+
+BATCH_SIZE = 20
+
+
+def add_columns():
+    """
+    create_all 은 이미 있는 table 에 column 을 추가하지 않으므로 thumbnail_url, medium_url column 이 없으면 추가
+    """
+    columns = [column["name"] for column in inspect(engine).get_columns(Photo.__tablename__)]
+    with engine.begin() as conn:
+        for name in ("thumbnail_url", "medium_url"):
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE photo ADD COLUMN {name} VARCHAR(2000) NULL"))
+
+
+async def make_variants(photo_id: int, url: str):
+    key = storage.key_of(url)
+    try:
+        variants = await images.make_variants(await storage.read(key))
+    except Exception as e:
+        print(f"skip photo {photo_id}: {e!r}")
+        return photo_id, None
+    urls = {}
+    for name, (body, content_type) in variants.items():
+        urls[f"{name}_url"] = await storage.put(body, images.variant_key(key, name), content_type)
+    return photo_id, urls
+
+
+async def backfill():
+    photo = Photo.__table__
+    last_id = 0
+    converted = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(photo.c.photo_id, photo.c.url)
+                .where(photo.c.photo_id > last_id, photo.c.thumbnail_url.is_(None))
+                .order_by(photo.c.photo_id)
+                .limit(BATCH_SIZE)
+            ).all()
+        if not rows:
+            break
+        results = await asyncio.gather(*[make_variants(photo_id, url) for photo_id, url in rows])
+        with engine.begin() as conn:
+            for photo_id, urls in results:
+                if urls:
+                    conn.execute(update(photo).where(photo.c.photo_id == photo_id).values(**urls))
+                    converted += 1
+        last_id = rows[-1].photo_id
+        print(f"converted {converted} photos (up to photo_id {last_id})")
+
+
+if __name__ == "__main__":
+    add_columns()
+    asyncio.run(backfill())
@@ -0,0 +1,65 @@
+"""
+post_counter 의 partition 별 게시물 수를 실제 게시물 수로 채우거나 다시 맞추는 작업
+배포할 때 한 번 실행해서 counter 를 채우고, 이후에는 주기적으로 실행해서 어긋난 값을 바로잡음
+프로젝트 루트에서 python -m scripts.reconcile_post_counters 로 실행
+"""
+from sqlalchemy import and_, func, inspect, select, update
+
+from core.db import engine, Base
+from models.post import HOUSE_ACCOUNT_ID, Post, PostCounter, add_to_counter
+
+
+def partition_conditions(conn) -> dict:
+    """
+    partition 이름과 그 partition 에 속하는 게시물 조건, CRUD 의 feed paging 조건과 같아야 함
+    """
+    post = Post.__table__
+    visible = post.c.use_locker != 1
+    conditions = {
+        "feed": and_(visible, post.c.account_id != HOUSE_ACCOUNT_ID),
+        "house": and_(visible, post.c.account_id == HOUSE_ACCOUNT_ID),
+    }
+    categories = conn.execute(select(post.c.category_id).where(post.c.account_id == HOUSE_ACCOUNT_ID).distinct()).scalars()
+    for category_id in categories:
+        conditions[f"house:{category_id}"] = and_(conditions["house"], post.c.category_id == category_id)
+    return conditions
+
+
+def create_table():
+    """
+    post_counter 를 만듦, partition column 을 쓰던 예전 table 이면 지우고 다시 만듦 (모든 값은 reconcile 이 다시 채움)
+    """
+    counter = PostCounter.__table__
+    if inspect(engine).has_table(counter.name):
+        columns = [column["name"] for column in inspect(engine).get_columns(counter.name)]
+        if "partition_key" not in columns or "reconcile_time" not in columns:
+            counter.drop(bind=engine)
+    Base.metadata.create_all(bind=engine, tables=[counter])
+
+
+def reconcile():
+    create_table()
+    post = Post.__table__
+    counter = PostCounter.__table__
+    with engine.connect() as conn:
+        conditions = partition_conditions(conn)
+        partitions = sorted(set(conditions) | set(conn.execute(select(counter.c.partition_key)).scalars()))
+    with engine.begin() as conn:
+        # 먼저 counter row 들을 잠가서(없으면 0 으로 만들어서), 세는 동안 게시물을 쓰는 transaction 은 counter 갱신에서 기다리게 함
+        # 게시물 수는 잠근 뒤의 첫 일반 SELECT 시점으로 읽으므로 이미 commit 된 쓰기는 세어지고, 기다린 쓰기는 이 transaction 이 끝난 뒤에 더해짐
+        for partition in partitions:
+            add_to_counter(conn, partition, 0)
+        stored = dict(conn.execute(select(counter.c.partition_key, counter.c.row_count).with_for_update()).all())
+        for partition in partitions:
+            condition = conditions.get(partition)
+            row_count = conn.execute(select(func.count()).select_from(post).where(condition)).scalar() if condition is not None else 0
+            if stored.get(partition) != row_count:
+                print(f"{partition}: {stored.get(partition)} -> {row_count}")
+            conn.execute(
+                update(counter).where(counter.c.partition_key == partition).values(row_count=row_count, reconcile_time=func.now())
+            )
+    print("done")
+
+
+if __name__ == "__main__":
+    reconcile()